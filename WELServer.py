@@ -1,29 +1,1203 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 import datetime as dt
 from dateutil.relativedelta import relativedelta
 import re
-from wget import download
+import math
+import ast
+from functools import lru_cache, wraps
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from collections import OrderedDict, ChainMap
 import os
-import sys
+import warnings
+import threading
 from shutil import move
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+import zipfile
+import json
 import argparse
-from astral import sun, LocationInfo
-from pymongo import MongoClient
+from astral import sun, LocationInfo, Observer
 from dateutil import tz
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:
+    pa = None
+    feather = None
 
+# Plotting, download and mongo modules are imported where they are first used,
+# so data only users don't pay for them at import.
 
-def mongoConnect():
-    if sys.platform == 'linux':
-        address = "mongodb://localhost:27017"
-        client = MongoClient(address)
-    elif sys.platform == 'darwin':
-        address = "mongodb://192.168.68.101:27017"
-        client = MongoClient(address)
+
+"""
+Settings for new mongo clients. address defaults to the WEL_MONGO_ADDRESS
+environment variable, then the local server. The rest are passed on to
+MongoClient, see mongoConfigure.
+"""
+mongo_settings = {'address': os.environ.get('WEL_MONGO_ADDRESS',
+                                            'mongodb://localhost:27017'),
+                  'database': 'WEL',
+                  'maxPoolSize': 10,
+                  'connectTimeoutMS': 5000,
+                  'serverSelectionTimeoutMS': 5000,
+                  'socketTimeoutMS': 30000,
+                  'readPreference': 'primaryPreferred'}
+
+# One shared client per distinct set of settings. MongoClient pools its
+# connections and is thread safe, but must not be used across a fork.
+mongo_clients = {}
+mongo_async_clients = {}     # per event loop, async clients are bound to it
+mongo_lock = threading.Lock()
+
+
+def mongo_after_fork():
+    global mongo_lock
+    mongo_clients.clear()
+    mongo_async_clients.clear()
+    mongo_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=mongo_after_fork)
+
+
+"""
+Change the settings used by later mongoConnect calls, e.g.
+mongoConfigure(address='mongodb://192.168.68.101:27017', maxPoolSize=4).
+Clients already handed out keep their settings.
+"""
+def mongoConfigure(**settings):
+    mongo_settings.update(settings)
+
+
+"""
+Database handle on a shared, pooled client. Clients are created on first
+use and reused by every WELData with the same settings, in this process.
+
+optional **settings : override mongo_settings for this call.
+"""
+def mongoConnect(**settings):
+    settings = {**mongo_settings, **settings}
+    key = tuple(sorted(settings.items()))
+    with mongo_lock:
+        client = mongo_clients.get(key)
+        if client is None:
+            from pymongo import MongoClient
+            options = dict(settings)
+            address = options.pop('address')
+            options.pop('database')
+            client = MongoClient(address, **options)
+            mongo_clients[key] = client
+    return client[settings['database']]
+
+
+"""
+Database handle on a shared async client for the running event loop, as
+mongoConnect. Uses pymongo's AsyncMongoClient, or motor with older pymongo.
+
+optional **settings : override mongo_settings for this call.
+
+returns None if neither async driver is installed.
+"""
+def mongoConnectAsync(**settings):
+    import asyncio
+    settings = {**mongo_settings, **settings}
+    key = tuple(sorted(settings.items()))
+    loop = asyncio.get_running_loop()
+    with mongo_lock:
+        # Clients of loops that have closed since can't be used any more
+        stale = [old for old in mongo_async_clients if old.is_closed()]
+        stale = [(old, mongo_async_clients.pop(old)) for old in stale]
+        clients = mongo_async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            try:
+                from pymongo import AsyncMongoClient
+            except ImportError:
+                try:
+                    from motor.motor_asyncio import \
+                        AsyncIOMotorClient as AsyncMongoClient
+                except ImportError:
+                    return None
+            options = dict(settings)
+            address = options.pop('address')
+            options.pop('database')
+            client = AsyncMongoClient(address, **options)
+            clients[key] = client
+    for old, old_clients in stale:
+        [mongoCloseAsync(old, client) for client in old_clients.values()]
+    return client[settings['database']]
+
+
+"""
+Close an async client on its event loop. AsyncMongoClient closes in a
+coroutine, which is run on the loop, or scheduled if the loop is running.
+Motor closes straight away.
+
+loop : event loop the client was made on.
+client : async client.
+"""
+def mongoCloseAsync(loop,
+                    client):
+    import asyncio
+    closing = client.close()
+    if not asyncio.iscoroutine(closing):
+        return
+    if loop.is_closed():
+        # Nothing left to run it on, the sockets went with the loop
+        closing.close()
+    elif loop.is_running():
+        asyncio.run_coroutine_threadsafe(closing, loop)
     else:
-        raise("Unrecognized platform")
-    return client.WEL
+        loop.run_until_complete(closing)
+
+
+"""
+Database handle for plain blocking reads on the same server and database
+as an async driver database, for the reads load_async runs in the executor.
+Clients from mongoConnectAsync get the shared mongoConnect client with the
+same settings. Other motor clients wrap a blocking database already. Other
+AsyncMongoClients need a mongo_connection passed next to them.
+
+async_db : async driver database.
+"""
+def mongoConnectSync(async_db):
+    with mongo_lock:
+        settings = [dict(key) for clients in mongo_async_clients.values()
+                    for key, client in clients.items()
+                    if client is async_db.client]
+    if len(settings) > 0:
+        return mongoConnect(**{**settings[0], 'database': async_db.name})
+    try:
+        from pymongo import AsyncMongoClient
+    except ImportError:
+        AsyncMongoClient = None
+    if (AsyncMongoClient is not None
+            and isinstance(async_db.client, AsyncMongoClient)):
+        raise Exception("Unknown AsyncMongoClient settings, pass a "
+                        "mongo_connection for blocking reads too.")
+    return async_db.delegate
+
+
+"""
+Close every shared client, e.g. at service shutdown, async ones included.
+"""
+def mongoClose():
+    with mongo_lock:
+        [client.close() for client in mongo_clients.values()]
+        mongo_clients.clear()
+        loops = list(mongo_async_clients.items())
+        mongo_async_clients.clear()
+    for loop, clients in loops:
+        [mongoCloseAsync(loop, client) for client in clients.values()]
+
+
+"""
+Parse an expression string once into compiled code, along with the set of
+names it uses. Names are matched against column names exactly when it is
+evaluated.
+"""
+@lru_cache(maxsize=256)
+def compileExpr(string):
+    tree = ast.parse(string.strip(), mode='eval')
+    names = frozenset(node.id for node in ast.walk(tree)
+                      if isinstance(node, ast.Name))
+    return compile(tree, F'<expr {string}>', 'eval'), names
+
+
+derived_cols = {}
+
+
+"""
+Register a derived column computed from other columns. Derived columns are
+only calculated the first time they are used, see WELData.derive.
+
+name : column name.
+deps : columns it is calculated from, which may be derived themselves.
+
+The decorated function takes a frame of the deps and returns a series.
+"""
+def derived(name,
+            deps):
+    def register(func):
+        derived_cols[name] = (deps, func)
+        return func
+    return register
+
+
+@derived('T_diff', ['living_T', 'outside_T'])
+def T_diff(frame):
+    return frame['living_T'] - frame['outside_T']
+
+
+@derived('COP', ['TAH_fpm', 'TAH_out_T', 'TAH_in_T', 'HP_W'])
+def COP(frame):
+    cops = (((1.15 * 0.37 * frame['TAH_fpm'])
+            * (np.abs(frame['TAH_out_T'] - frame['TAH_in_T'])))
+            / (frame['HP_W'] / 1000))
+    cops[cops > 12] = np.nan
+    return cops
+
+
+@derived('well_W', ['loop_out_T', 'loop_in_T'])
+def well_W(frame):
+    well_gpm = 13.6
+    return ((well_gpm * 0.0630902) * 4.186
+            * (np.abs(frame['loop_out_T'] - frame['loop_in_T'])))
+
+
+@derived('well_COP', ['well_W', 'HP_W'])
+def well_COP(frame):
+    well_COP = frame['well_W'] / (frame['HP_W'] / 1000)
+    well_COP[well_COP > 10] = np.nan
+    return well_COP
+
+
+sun_cache = {}
+
+
+"""
+Sunrise and sunset on a date at a location, cached across calls. dateutil
+timezones aren't hashable, so the cache is keyed on their repr.
+
+returns (sunrise, sunset) as datetimes in tzone.
+"""
+def sunriseSunset(latitude,
+                  longitude,
+                  tzone,
+                  day):
+    key = (latitude, longitude, repr(tzone), day)
+    if key not in sun_cache:
+        observer = Observer(latitude=latitude, longitude=longitude)
+        sun_cache[key] = (sun.sunrise(observer, date=day, tzinfo=tzone),
+                          sun.sunset(observer, date=day, tzinfo=tzone))
+    return sun_cache[key]
+
+
+"""
+Hours each sample of a time index stands for, up to the next sample. Gaps
+in the log are capped at 5 typical steps so outages don't count as running
+time.
+
+returns series of hours aligned with the index.
+"""
+def sampleHours(index):
+    step = index.to_series().diff().shift(-1).dt.total_seconds()
+    typical = np.nanmedian(step)
+    return step.fillna(typical).clip(upper=5 * typical) / 3600
+
+
+"""
+Find the on-runs of a status channel in one pass.
+
+on : status values, 1 for on.
+
+returns arrays of run start and stop row positions, stop exclusive.
+"""
+def runEdges(on):
+    padded = np.concatenate(([0], np.asarray(on) == 1, [0])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return edges[0::2], edges[1::2]
+
+
+"""
+Create the ascending dateandtime index used by WELData.read_mongo.
+
+mongo_db : mongo database holding the data collection.
+"""
+def ensure_mongo_index(mongo_db):
+    return mongo_db.data.create_index([('dateandtime', 1)])
+
+
+"""
+Read a single monthly log in a worker process for WELData.stitch.
+"""
+def read_log_worker(filepath,
+                    cache_logs=True,
+                    to_tzone=None):
+    dat = WELData.__new__(WELData)
+    dat.cache_logs = cache_logs
+    if to_tzone is not None:
+        dat.to_tzone = to_tzone
+    return dat.read_raw_log(filepath)
+
+
+"""
+Default HTTP fetcher for LogSync: download url to filepath without a progress
+bar.
+"""
+def wget_fetch(url,
+               filepath):
+    from wget import download
+    downfile = download(url, filepath, bar=None)
+    if downfile != filepath:
+        move(downfile, filepath)
+
+
+class LogSync:
+    """
+    Keeps a local folder of WEL monthly logs in sync with the WEL server
+    archive. Missing months are downloaded concurrently and unzipped in place.
+    Finished months are recorded in a manifest in the folder so they are never
+    checked again.
+
+    dl_db_path : folder holding the monthly .xls logs.
+    fetch : callable fetch(url, filepath) writing the url's content to
+            filepath. Defaults to wget.
+    max_workers : maximum concurrent downloads.
+    base_url : url of the archive folder.
+    """
+    first = dt.date(2020, 3, 1)
+    manifest_name = 'manifest.json'
+
+    def __init__(self,
+                 dl_db_path,
+                 fetch=None,
+                 max_workers=4,
+                 base_url='http://www.welserver.com/WEL1060/'):
+        self.dl_db_path = dl_db_path
+        self.fetch = wget_fetch if fetch is None else fetch
+        self.max_workers = max_workers
+        self.base_url = base_url
+        self.manifest_path = os.path.join(dl_db_path, self.manifest_name)
+
+    def month_name(self,
+                   month):
+        return F'WEL_log_{month.year}_{month.month:02d}'
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return set()
+        with open(self.manifest_path) as f:
+            return set(json.load(f)['complete'])
+
+    def save_manifest(self,
+                      complete):
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump({'complete': sorted(complete)}, f, indent=1)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    """
+    Download and unzip a single month.
+
+    month : date in the month to download.
+    forcedl : download even if the log is already in the folder.
+
+    returns True if the month's log is in the folder afterwards.
+    """
+    def sync_month(self,
+                   month,
+                   forcedl=False):
+        name = self.month_name(month)
+        path_xls = os.path.join(self.dl_db_path, name + '.xls')
+        path_zip = os.path.join(self.dl_db_path, name + '.zip')
+        if os.path.exists(path_xls) and not forcedl:
+            return True
+        try:
+            self.fetch(self.base_url + name + '.zip', path_zip)
+            with zipfile.ZipFile(path_zip) as archive:
+                archive.extractall(self.dl_db_path)
+        except Exception:
+            print(F'{month.year}-{month.month}: Not available for download')
+            return False
+        finally:
+            if os.path.exists(path_zip):
+                os.remove(path_zip)
+        print(F'{month.year}-{month.month}: downloaded')
+        return os.path.exists(path_xls)
+
+    """
+    Whether the month's log in the folder was written after the month
+    ended, so it holds the whole month.
+    """
+    def finished_on_disk(self,
+                         month):
+        path_xls = os.path.join(self.dl_db_path,
+                                self.month_name(month) + '.xls')
+        if not os.path.exists(path_xls):
+            return False
+        end = dt.datetime(month.year, month.month, 1) + relativedelta(months=1)
+        return os.path.getmtime(path_xls) >= end.timestamp()
+
+    """
+    Download all months since LogSync.first that are not in the manifest.
+    Past months are added to the manifest once their log is in the folder.
+    A past month whose log was downloaded before the month ended is
+    downloaded again first. The current month is still being written on the
+    server and is never marked complete.
+
+    now : current time.
+    forcedl : redownload every month, ignoring the manifest.
+
+    returns list of months that were synced.
+    """
+    def sync(self,
+             now,
+             forcedl=False):
+        if not os.path.exists(self.dl_db_path):
+            os.mkdir(self.dl_db_path)
+        complete = set() if forcedl else self.load_manifest()
+        num_months = ((now.year - self.first.year) * 12
+                      + now.month - self.first.month)
+        monthlist = [self.first + relativedelta(months=x)
+                     for x in range(num_months + 1)]
+        current = self.month_name(now)
+        todo = [month for month in monthlist
+                if self.month_name(month) not in complete]
+
+        synced = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {}
+            for month in todo:
+                past = self.month_name(month) != current
+                redownload = forcedl or (past
+                                         and not self.finished_on_disk(month))
+                futures[pool.submit(self.sync_month, month,
+                                    redownload)] = month
+            for future in as_completed(futures):
+                month = futures[future]
+                if future.result():
+                    synced.append(month)
+                    if self.month_name(month) != current:
+                        complete.add(self.month_name(month))
+                        self.save_manifest(complete)
+        return sorted(synced)
+
+
+class MongoBackfill:
+    """
+    Imports WEL monthly logs from a download db folder into the mongo data
+    collection read in Pi mode, so history from before the Pi logger loads
+    without parsing Excel. Rows are written in batches keyed on dateandtime,
+    with timestamps converted to naive UTC as the Pi logger stores them.
+    Imported months are recorded in a backfill collection along with the
+    log's size and mtime, so a rerun skips them unless the log changed, and
+    an interrupted month is redone on the next run without duplicates.
+
+    dl_db_path : folder holding the monthly .xls logs, see LogSync.
+    mongo_db : mongo database to import into.
+    optional collection : name of the data collection.
+    optional batch : rows per bulk write.
+    optional timeseries : create the collection as a time series collection
+                          if it doesn't exist yet. Those don't take upserts,
+                          so only rows not already there are inserted.
+    """
+    progress_name = 'backfill'
+
+    def __init__(self,
+                 dl_db_path,
+                 mongo_db,
+                 collection='data',
+                 batch=5000,
+                 timeseries=False):
+        self.dl_db_path = dl_db_path
+        self.mongo_db = mongo_db
+        self.collection = collection
+        self.batch = batch
+        self.timeseries = timeseries
+
+    """
+    Create the data collection if needed, and its dateandtime index.
+    """
+    def ensure_collection(self):
+        if self.timeseries and \
+                self.collection not in self.mongo_db.list_collection_names():
+            self.mongo_db.create_collection(
+                self.collection, timeseries={'timeField': 'dateandtime',
+                                             'granularity': 'minutes'})
+        self.mongo_db[self.collection].create_index([('dateandtime', 1)])
+
+    def log_stamp(self,
+                  filepath):
+        stat = os.stat(filepath)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    """
+    Documents for the rows of a loaded log, leaving out missing values.
+
+    frame : log as returned by WELData.read_raw_log.
+    """
+    def documents(self,
+                  frame):
+        frame = frame.drop(columns=['dateandtime'], errors='ignore')
+        times = frame.index.tz_convert('UTC').tz_localize(None) \
+            .to_pydatetime()
+        records = frame.to_dict('records')
+        return [{'dateandtime': time,
+                 **{key: value for key, value in record.items()
+                    if value == value}}
+                for time, record in zip(times, records)]
+
+    """
+    Write documents to the data collection, batch by batch.
+
+    returns number of rows written.
+    """
+    def write(self,
+              docs):
+        from pymongo import UpdateOne
+        data = self.mongo_db[self.collection]
+        if self.timeseries and len(docs) > 0:
+            times = [doc['dateandtime'] for doc in docs]
+            query = {'dateandtime': {'$gte': min(times),
+                                     '$lte': max(times)}}
+            there = {doc['dateandtime'] for doc in
+                     data.find(query, {'_id': 0, 'dateandtime': 1})}
+            docs = [doc for doc in docs if doc['dateandtime'] not in there]
+        for start in range(0, len(docs), self.batch):
+            chunk = docs[start:start + self.batch]
+            if self.timeseries:
+                data.insert_many(chunk, ordered=False)
+            else:
+                data.bulk_write([UpdateOne({'dateandtime':
+                                            doc['dateandtime']},
+                                           {'$set': doc}, upsert=True)
+                                 for doc in chunk], ordered=False)
+        return len(docs)
+
+    """
+    Import one monthly log.
+
+    filepath : path of the log.
+    to_tzone : timezone the log is read into, only the instant matters.
+
+    returns (rows written, seconds taken).
+    """
+    def import_month(self,
+                     filepath,
+                     to_tzone=tz.gettz('UTC')):
+        start = perf_counter()
+        frame = read_log_worker(filepath, to_tzone=to_tzone)
+        rows = self.write(self.documents(frame))
+        self.mongo_db[self.progress_name].replace_one(
+            {'_id': os.path.basename(filepath)},
+            {'stamp': self.log_stamp(filepath), 'rows': rows}, upsert=True)
+        return rows, perf_counter() - start
+
+    """
+    Import every log in the folder that isn't recorded as imported, or whose
+    file changed since.
+
+    optional force : reimport every log.
+
+    returns total rows written.
+    """
+    def run(self,
+            force=False):
+        self.ensure_collection()
+        progress = {doc['_id']: doc['stamp'] for doc in
+                    self.mongo_db[self.progress_name].find()}
+        names = sorted(name for name in os.listdir(self.dl_db_path)
+                       if re.fullmatch(r'WEL_log_\d{4}_\d{2}\.xls', name))
+        total = 0
+        for name in names:
+            filepath = os.path.join(self.dl_db_path, name)
+            if not force and progress.get(name) == self.log_stamp(filepath):
+                continue
+            rows, seconds = self.import_month(filepath)
+            total += rows
+            print(F'{name}: {rows} rows in {seconds:.1f} s, '
+                  F'{rows / seconds:.0f} rows/s')
+        return total
+
+
+class RollupStore:
+    """
+    Hourly and daily aggregates of WEL data kept in feather files, so long
+    range summaries don't need the raw samples. Each bucket holds, for every
+    analog and derived column, its mean/min/max/count as <col>__<stat>. Power
+    columns also get their energy in Wh as <col>__Wh, and status channels
+    their runtime as <col>__hours.
+
+    rollup_path : folder holding the rollup files.
+    """
+    freqs = ['h', 'D']
+    energy_cols = {'HP_W': 1, 'TAH_W': 1, 'well_W': 1000}   # to W
+
+    def __init__(self,
+                 rollup_path):
+        self.rollup_path = rollup_path
+
+    def file_path(self,
+                  freq):
+        return os.path.join(self.rollup_path, F'rollup_{freq}.feather')
+
+    """
+    Stored rollup rows of one frequency, indexed by bucket start.
+    """
+    def read(self,
+             freq):
+        filepath = self.file_path(freq)
+        if feather is None or not os.path.exists(filepath):
+            return pd.DataFrame()
+        return feather.read_feather(filepath, memory_map=True) \
+            .set_index('bucket')
+
+    def write(self,
+              freq,
+              rollup):
+        if not os.path.exists(self.rollup_path):
+            os.mkdir(self.rollup_path)
+        filepath = self.file_path(freq)
+        feather.write_feather(rollup.reset_index(names='bucket'),
+                              filepath + '.tmp', compression='uncompressed')
+        os.replace(filepath + '.tmp', filepath)
+
+    """
+    Aggregate a frame into buckets. Only buckets the frame fully covers are
+    returned, so partial hours or days at the edges of a load are never
+    stored.
+
+    frame : frame indexed by time, with derived columns already added.
+    freq : bucket frequency, 'h' or 'D'.
+    """
+    def compute(self,
+                frame,
+                freq):
+        if len(frame) < 2:
+            return pd.DataFrame()
+        step = sampleHours(frame.index)
+        typical = step.median() * 3600
+
+        status = [col for col in frame.columns if col.endswith('_b')]
+        analog = [col for col in frame.select_dtypes('number').columns
+                  if col not in status]
+        stats = frame[analog].resample(freq).agg(['mean', 'min', 'max',
+                                                  'count'])
+        stats.columns = [F'{col}__{stat}' for col, stat in stats.columns]
+        parts = [stats]
+        energy = {col: scale for col, scale in self.energy_cols.items()
+                  if col in analog}
+        if len(energy) > 0:
+            watts = frame[list(energy)].mul(pd.Series(energy))
+            parts.append(watts.mul(step, axis=0).resample(freq)
+                         .sum(min_count=1).add_suffix('__Wh'))
+        if len(status) > 0:
+            parts.append((frame[status] == 1).mul(step, axis=0)
+                         .resample(freq).sum().add_suffix('__hours'))
+        rollup = pd.concat(parts, axis=1)
+
+        tolerance = pd.Timedelta(seconds=typical)
+        ends = rollup.index + pd.tseries.frequencies.to_offset(freq)
+        covered = ((rollup.index >= frame.index[0] - tolerance)
+                   & (ends <= frame.index[-1] + tolerance))
+        return rollup[covered]
+
+    """
+    Recompute the buckets covered by a frame and merge them into the store,
+    replacing any stored rows for the same buckets.
+
+    returns number of buckets written per frequency.
+    """
+    def update(self,
+               frame):
+        written = {}
+        for freq in self.freqs:
+            new = self.compute(frame, freq)
+            if len(new) == 0:
+                written[freq] = 0
+                continue
+            written[freq] = len(new)
+            stored = self.read(freq)
+            if len(stored) > 0:
+                stored = stored[~stored.index.isin(new.index)]
+                new = pd.concat((stored, new)).sort_index()
+            self.write(freq, new)
+        return written
+
+    """
+    Stored buckets starting within a time range.
+
+    start, end : time range.
+    optional freq : 'h' or 'D'.
+    optional columns : rollup columns to return, default all.
+    """
+    def summary(self,
+                start,
+                end,
+                freq='D',
+                columns=None):
+        rollup = self.read(freq)
+        if len(rollup) == 0:
+            return rollup
+        rollup = rollup[(rollup.index >= start) & (rollup.index < end)]
+        if columns is not None:
+            rollup = rollup[columns]
+        return rollup
+
+
+class SegmentCache:
+    """
+    Raw data already loaded, kept per source as segments covering known time
+    intervals, shared by every WELData in the process. A request only
+    fetches the gaps between the segments it overlaps, and the result is
+    merged with them into one segment. Least recently used segments are
+    evicted once the cache holds more than max_bytes.
+
+    max_bytes : memory budget for all cached frames.
+    optional settle : how far behind now the logger may still be writing.
+                      Fetches reaching later than that only count as
+                      covering up to their last row, and no later than
+                      now - settle, so rows logged late are fetched again.
+    """
+    def __init__(self,
+                 max_bytes=256 * 2**20,
+                 settle=dt.timedelta(minutes=15)):
+        self.max_bytes = max_bytes
+        self.settle = settle
+        # (source key, start) -> [start, end, frame, bytes], oldest use first
+        self.segments = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    """
+    Cached segments of a source overlapping start to end, in time order,
+    and the gaps between them as (start, end) pairs. Call with lock held.
+    """
+    def plan(self,
+             key,
+             start,
+             end):
+        overlap = sorted([segment for (seg_key, seg_start), segment
+                          in self.segments.items()
+                          if seg_key == key and seg_start <= end
+                          and segment[1] >= start],
+                         key=lambda segment: segment[0])
+        gaps = []
+        cursor = start
+        for segment in overlap:
+            if segment[0] > cursor:
+                gaps.append((cursor, segment[0]))
+            cursor = max(cursor, segment[1])
+        if cursor < end:
+            gaps.append((cursor, end))
+        return overlap, gaps
+
+    """
+    returns the (start, end) pairs get would have to fetch right now.
+    """
+    def gaps(self,
+             key,
+             start,
+             end):
+        with self.lock:
+            return self.plan(key, start, end)[1]
+
+    """
+    Rows of a source between start and end inclusive, fetching only what
+    isn't cached yet. Gaps are fetched without holding the lock, so loads
+    of other sources and windows aren't held up, then the plan is checked
+    again before merging in case other loads changed the cache meanwhile.
+
+    key : hashable identifying the source.
+    start, end : aware datetimes.
+    fetch : function of (start, end) returning the source rows in between,
+            inclusive, as a time indexed frame.
+
+    returns a copy of the rows.
+    """
+    def get(self,
+            key,
+            start,
+            end,
+            fetch):
+        # [start, end, frame, end of known rows] per fetched gap
+        fetched = []
+        while True:
+            with self.lock:
+                overlap, gaps = self.plan(key, start, end)
+                missing = [gap for gap in gaps
+                           if not any(done[0] <= gap[0] and gap[1] <= done[1]
+                                      for done in fetched)]
+                if len(missing) == 0:
+                    return self.merge(key, start, end, overlap, fetched)
+
+            for gap_start, gap_end in missing:
+                frame = fetch(gap_start, gap_end)
+                known = gap_end
+                # Recent rows may still arrive, only count what came back
+                settled = dt.datetime.now(gap_end.tzinfo) - self.settle
+                if gap_end > settled:
+                    known = gap_start
+                    if len(frame) > 0:
+                        known = max(gap_start, min(frame.index[-1], settled))
+                fetched.append([gap_start, gap_end, frame, known])
+
+    """
+    Merge cached segments and fetched gaps into one segment, evicting as
+    needed. Call with lock held.
+
+    returns a copy of the rows between start and end.
+    """
+    def merge(self,
+              key,
+              start,
+              end,
+              overlap,
+              fetched):
+        frames = [segment[2] for segment in overlap] \
+            + [done[2] for done in fetched if len(done[2]) > 0]
+        if len(frames) == 0:
+            return pd.DataFrame()
+        if len(frames) == 1:
+            merged = frames[0]
+        else:
+            merged = pd.concat(frames).sort_index()
+            merged = merged[~merged.index.duplicated(keep='last')]
+        covered = [min([segment[0] for segment in overlap]
+                       + [done[0] for done in fetched]),
+                   max([segment[1] for segment in overlap]
+                       + [done[3] for done in fetched])]
+
+        for segment in overlap:
+            del self.segments[(key, segment[0])]
+            self.nbytes -= segment[3]
+        nbytes = int(merged.memory_usage().sum())
+        self.segments[(key, covered[0])] = [covered[0], covered[1],
+                                            merged, nbytes]
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self.segments) > 0:
+            self.nbytes -= self.segments.popitem(last=False)[1][3]
+
+        return merged.loc[start:end].copy()
+
+    def clear(self):
+        with self.lock:
+            self.segments.clear()
+            self.nbytes = 0
+
+
+class LoadStats:
+    """
+    Timing and row/byte counters for the load and plot stages of one
+    WELData. Each stage keeps its number of calls, total seconds and the
+    rows and bytes of the frames it returned. Stages can nest, e.g. read_log
+    time includes its calced_cols time.
+    """
+    fields = ['calls', 'seconds', 'rows', 'bytes']
+
+    def __init__(self):
+        self.stages = {}
+
+    """
+    Add one call of a stage.
+
+    name : stage name.
+    seconds : time the call took.
+    optional result : frame or series returned, counted into rows and bytes.
+    """
+    def record(self,
+               name,
+               seconds,
+               result=None):
+        stage = self.stages.setdefault(name, dict.fromkeys(self.fields, 0))
+        stage['calls'] += 1
+        stage['seconds'] += seconds
+        if isinstance(result, pd.DataFrame):
+            stage['rows'] += len(result)
+            stage['bytes'] += int(result.memory_usage().sum())
+        elif isinstance(result, pd.Series):
+            stage['rows'] += len(result)
+            stage['bytes'] += int(result.memory_usage())
+
+    """
+    Context manager timing a block as one call of a stage.
+    """
+    @contextmanager
+    def timer(self,
+              name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - start)
+
+    def reset(self):
+        self.stages = {}
+
+    """
+    returns the counters as a JSON string, written to filepath if given.
+    """
+    def to_json(self,
+                filepath=None):
+        text = json.dumps(self.stages, indent=1, sort_keys=True)
+        if filepath is not None:
+            with open(filepath, 'w') as f:
+                f.write(text)
+        return text
+
+    """
+    returns the counters in the Prometheus text format, written to filepath
+    if given, e.g. for the node exporter textfile collector.
+
+    optional prefix : metric name prefix.
+    """
+    def to_prometheus(self,
+                      filepath=None,
+                      prefix='welpy'):
+        lines = []
+        for field in self.fields:
+            metric = F'{prefix}_{field}_total'
+            lines.append(F'# HELP {metric} WELData {field} per stage.')
+            lines.append(F'# TYPE {metric} counter')
+            lines += [F'{metric}{{stage="{name}"}} {stage[field]}'
+                      for name, stage in sorted(self.stages.items())]
+        text = '\n'.join(lines) + '\n'
+        if filepath is not None:
+            with open(filepath + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(filepath + '.tmp', filepath)
+        return text
+
+
+"""
+Record calls of a WELData method as a stage in its stats. Methods run
+untouched when stats is None.
+
+name : stage name.
+"""
+def profiled(name):
+    def wrap(func):
+        @wraps(func)
+        def timed(self, *args, **kwargs):
+            if self.stats is None:
+                return func(self, *args, **kwargs)
+            start = perf_counter()
+            result = func(self, *args, **kwargs)
+            self.stats.record(name, perf_counter() - start, result)
+            return result
+        return timed
+    return wrap
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of (time, value) samples for live plotting. Every
+    sample is written twice, capacity apart, so the newest capacity samples
+    are always one contiguous slice and appending costs the same however
+    long the plot runs.
+
+    capacity : number of samples kept.
+    """
+    def __init__(self,
+                 capacity):
+        self.capacity = capacity
+        self.times = np.full(2 * capacity, np.nan)
+        self.values = np.full(2 * capacity, np.nan)
+        self.count = 0
+
+    """
+    Append samples, optionally overwriting the last few stored ones first.
+
+    times : matplotlib date numbers.
+    values : sample values.
+    optional replace : number of stored samples to overwrite.
+    """
+    def extend(self,
+               times,
+               values,
+               replace=0):
+        self.count -= min(replace, self.count)
+        times = np.asarray(times, dtype=np.float64)[-self.capacity:]
+        values = np.asarray(values, dtype=np.float64)[-self.capacity:]
+        pos = (self.count + np.arange(len(times))) % self.capacity
+        self.times[pos] = self.times[pos + self.capacity] = times
+        self.values[pos] = self.values[pos + self.capacity] = values
+        self.count += len(times)
+
+    """
+    Stored samples, oldest first, as views into the buffer.
+    """
+    def view(self):
+        if self.count <= self.capacity:
+            return self.times[:self.count], self.values[:self.count]
+        start = self.count % self.capacity
+        return (self.times[start:start + self.capacity],
+                self.values[start:start + self.capacity])
+
+
+class LivePlot:
+    """
+    Live updating plotVar panel. The axes, grid, labels and night shading
+    are drawn once and cached as a background bitmap. Each update only
+    evaluates the new rows, appends them to a ring buffer per line and
+    blits the lines over the cached background, so the cost per update
+    stays flat as the window fills. The background is redrawn only when
+    the data runs past the right edge of the view, which then jumps ahead
+    by headroom.
+
+    dat : loaded WELData, refreshed with refresh(slide=True) on update.
+    y : expression or list of expressions, as for plotVar.
+    optional statusmask : status mask expression, as for plotVar.
+    optional axes : axes to draw on instead of a new figure.
+    optional headroom : fraction of the window kept free on the right.
+    optional overlap : timedelta of earlier rows to evaluate new rows with,
+                       at least as long as any rolling window in y.
+    optional **kwargs : passed on to plotVar.
+    """
+    def __init__(self,
+                 dat,
+                 y,
+                 statusmask=None,
+                 axes=None,
+                 headroom=0.1,
+                 overlap=None,
+                 **kwargs):
+        import matplotlib.pyplot as plt
+        import matplotlib.dates as mdates
+        if type(y) is not list:
+            y = [y]
+        self.dat = dat
+        self.y = y
+        self.statusmask = statusmask
+        self.overlap = overlap
+        self.window = dat.timerange[1] - dat.timerange[0]
+        self.headroom = self.window * headroom
+        if axes is None:
+            fig = plt.figure(figsize=dat.figsize)
+            axes = plt.gca()
+        self.axes = axes
+        self.canvas = axes.figure.canvas
+
+        before = len(axes.get_lines())
+        dat.plotVar(y, statusmask=statusmask, maskghost=False, axes=axes,
+                    **kwargs)
+        self.lines = axes.get_lines()[before:]
+        ploty, masked = dat.plotData(y, statusmask)
+        # Enough samples for the window plus headroom at the sample period,
+        # doubled for the gap rows masking inserts between intervals.
+        capacity = 2 * max(math.ceil((self.window + self.headroom)
+                                     / dat.sample_period), 1)
+        self.buffers = [RingBuffer(capacity) for line in self.lines]
+        for buffer, datum in zip(self.buffers, masked):
+            buffer.extend(mdates.date2num(datum.index), datum)
+        for line in self.lines:
+            line.set_animated(True)
+        self.redraw()
+
+    """
+    Redraw the background with the view moved to the current timerange,
+    and cache it.
+    """
+    def redraw(self):
+        import matplotlib.dates as mdates
+        from matplotlib.collections import PolyCollection
+        self.axes.set_xlim(self.dat.timerange[0],
+                           self.dat.timerange[1] + self.headroom)
+        self.view_end = mdates.date2num(self.dat.timerange[1]
+                                        + self.headroom)
+        [collection.remove() for collection in self.axes.collections
+         if isinstance(collection, PolyCollection)]
+        self.dat.plotNighttime(axes=self.axes)
+        with self.dat.timer('render'):
+            self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self.blit()
+
+    def blit(self):
+        with self.dat.timer('blit'):
+            self.canvas.restore_region(self.background)
+            for line, buffer in zip(self.lines, self.buffers):
+                line.set_data(*buffer.view())
+                self.axes.draw_artist(line)
+            self.canvas.blit(self.axes.bbox)
+            self.canvas.flush_events()
+
+    """
+    Pull new rows into dat and draw them.
+
+    returns number of new rows.
+    """
+    def update(self):
+        import matplotlib.dates as mdates
+        new_rows = self.dat.refresh(slide=True)
+        if new_rows == 0:
+            return 0
+        # The last old row is redone too, its power reading changed
+        data = self.dat.data
+        start = len(data) - new_rows - 1
+        if self.overlap is not None:
+            start = min(start, data.index.searchsorted(
+                data.index[start] - self.overlap))
+        frame = data.iloc[max(start, 0):]
+        redo = min(new_rows + 1, len(frame))
+        if self.statusmask is not None:
+            smask = np.asarray(self.dat.evalFrame(frame, self.statusmask,
+                                                  mask=True), dtype=bool)
+        ymin, ymax = self.axes.get_ylim()
+        rescale = False
+        for buffer, expr in zip(self.buffers, self.y):
+            datum = self.dat.evalFrame(frame, expr)
+            if self.statusmask is not None:
+                datum = datum.where(smask)
+            datum = datum.iloc[-redo:]
+            buffer.extend(mdates.date2num(datum.index), datum,
+                          replace=redo - new_rows)
+            values = np.asarray(datum, dtype=np.float64)
+            values = values[np.isfinite(values)]
+            if len(values) > 0 and (values.min() < ymin
+                                    or values.max() > ymax):
+                rescale = True
+
+        if rescale:
+            self.axes.autoscale(enable=True, axis='y')
+            self.axes.relim()
+            self.axes.autoscale_view(scalex=False)
+            self.axes.autoscale(enable=False)
+        if rescale or mdates.date2num(self.dat.timerange[1]) > self.view_end:
+            self.redraw()
+        else:
+            self.blit()
+        return new_rows
+
+
+class DocumentArrays:
+    """
+    Column arrays filled one mongo document at a time, so a cursor can be
+    read without building a list of documents first. The arrays start at
+    size rows and double whenever they fill up.
+
+    size : number of rows to preallocate.
+    """
+    def __init__(self,
+                 size):
+        self.times = np.empty(max(size, 1), dtype='datetime64[us]')
+        self.arrays = {}
+        self.count = 0
+
+    """
+    Add one document as the next row.
+
+    doc : mongo document with a dateandtime key, consumed.
+    """
+    def append(self,
+               doc):
+        n = self.count
+        if n == len(self.times):
+            size = 2 * n
+            self.times.resize(size, refcheck=False)
+            for array in self.arrays.values():
+                array.resize(size, refcheck=False)
+                array[n:] = np.nan
+        self.times[n] = doc.pop('dateandtime')
+        for key, value in doc.items():
+            if key not in self.arrays:
+                self.arrays[key] = np.full(len(self.times), np.nan)
+            self.arrays[key][n] = np.nan if value is None else value
+        self.count = n + 1
+
+    """
+    Rows added so far as a frame with a naive dateandtime index.
+    """
+    def frame(self):
+        if self.count == 0:
+            return pd.DataFrame()
+        index = pd.DatetimeIndex(self.times[:self.count], name='dateandtime')
+        return pd.DataFrame({key: array[:self.count]
+                             for key, array in self.arrays.items()},
+                            index=index)
 
 
 class WELData:
@@ -32,25 +1206,69 @@ class WELData:
     dl_db_path = None
     db_tzone = tz.gettz('UTC')
     to_tzone = tz.gettz('America/New_York')
+    cache_logs = True        # keep parsed months as feather next to logs
+    log_cache_version = 2    # bump when the parsed month layout changes
+    load_workers = 1         # processes used to parse months in stitch
+    mongo_batch = 10000      # documents per mongo cursor batch
+    mongo_hint = None        # hint dateandtime index, None checks first
+    columns = None
+    resolution = None        # target pixel width for downsampled loads
+    sample_period = dt.timedelta(minutes=1)
+    expr_cache_size = 64     # evaluated expressions kept by evalExpr
+    expr_cache = None
+    data_version = 0         # bumped whenever data is reloaded or extended
+    power_cols = ['HP_W', 'TAH_W']  # shifted back one sample on load
+    power_head = None        # first row's power readings, see logged_power
+    intervals = None         # on-runs of each status channel, see runEdges
+    rollup_path = None       # RollupStore folder, defaults to dl_db_path
+    stats = None             # LoadStats when profiling, None costs nothing
+    segment_cache = SegmentCache()  # shared by all instances, None disables
+    inflight_loads = {}      # async window reads in progress, per event loop
+    load_task = None         # load_async in progress, shared by its callers
+    async_mongo_db = None
     mongo_db = None
     data_source = None
+    WEL_download = False
     now = None
-    data = None
+    loaded = None            # frame behind data
+    load_pending = False     # load on first use of data, see load
     timerange = None
 
     """
     Initialize the Weldata Object.
     If filepath is given, data will be read from the file, otherwise this
     month's log is downloaded and read.
+    In Pi mode, columns limits the channels read from mongo to those listed
+    and the ones their calculated columns need.
+    If resolution is given as a pixel width, long timeranges are loaded as the
+    min/max envelope of one bucket per pixel instead of every sample.
+    If profile is True, load and plot stages are timed into stats.
+    Nothing is downloaded, connected to or read until data is first used,
+    or load or load_async is called. async_mongo_connection is an async
+    driver database, e.g. from mongoConnectAsync, used by load_async. Reads
+    that need a blocking client go to the same server, see mongoConnectSync.
     """
     def __init__(self,
                  data_source='Pi',
                  timerange=None,
                  WEL_download=False,
                  dl_db_path='./log_db/',
-                 mongo_connection=None):
+                 mongo_connection=None,
+                 load_workers=1,
+                 columns=None,
+                 resolution=None,
+                 profile=False,
+                 async_mongo_connection=None):
+        self.stats = LoadStats() if profile else None
+        if data_source not in ('Pi', 'WEL'):
+            print("Valid data sources are 'Pi' or 'WEL'")
+            quit()
         self.data_source = data_source
+        self.WEL_download = WEL_download
         self.dl_db_path = dl_db_path
+        self.load_workers = load_workers
+        self.columns = columns
+        self.resolution = resolution
         self.now = dt.datetime.now().astimezone(self.to_tzone)
         if timerange is None:
             self.timerange = self.time_from_args()
@@ -60,31 +1278,225 @@ class WELData:
             self.timerange = self.timeCondition(timerange)
         self.timerange = [time.replace(tzinfo=self.to_tzone)
                           for time in self.timerange]
+        if mongo_connection is not None:
+            self.mongo_db = mongo_connection
+        if async_mongo_connection is not None:
+            self.async_mongo_db = async_mongo_connection
+        self.load_pending = True
 
-        if self.data_source == 'WEL':
-            self.refresh_db()
-            if WEL_download:
-                dat_url = ("http://www.welserver.com/WEL1060/"
-                           + F"WEL_log_{self.now.year}"
-                           + F"_{self.now.month:02d}.xls")
-                downfilepath = (self.dl_db_path
-                                + F"WEL_log_{self.now.year}"
-                                + F"_{self.now.month:02d}.xls")
-                downfile = download(dat_url, downfilepath)
-                print()
-                if os.path.exists(downfilepath):
-                    move(downfile, downfilepath)
+    """
+    Loaded data, indexed by time in to_tzone. The first use loads timerange.
+    Assigning a frame replaces it as a new version of data, with the on-run
+    index rebuilt and derived columns calculated from it as given.
+    """
+    @property
+    def data(self):
+        if self.load_pending:
+            self.load()
+        return self.loaded
 
+    @data.setter
+    def data(self,
+             frame):
+        self.loaded = frame
+        self.power_head = None
+        self.intervals = None
+        if frame is not None:
+            self.build_intervals()
+        self.data_version += 1
+
+    """
+    Sync the download db, or connect to mongo, and load timerange. Called on
+    the first use of data, or directly to load up front.
+
+    returns self.
+    """
+    def load(self):
+        self.load_pending = False
+        try:
+            if self.data_source == 'WEL':
+                self.refresh_db()
+                if self.WEL_download:
+                    self.download_current_log()
+            elif self.mongo_db is None:
+                with self.timer('mongoConnect'):
+                    if self.async_mongo_db is None:
+                        self.mongo_db = mongoConnect()
+                    else:
+                        self.mongo_db = mongoConnectSync(self.async_mongo_db)
             self.stitch()
-        elif self.data_source == 'Pi':
-            if mongo_connection is None:
-                self.mongo_db = mongoConnect()
-            else:
-                self.mongo_db = mongo_connection
-            self.stitch()
-        else:
-            print("Valid data sources are 'Pi' or 'WEL'")
-            quit()
+        except BaseException:
+            self.load_pending = True
+            raise
+        return self
+
+    """
+    Async counterpart of load, e.g. dat = await WELData(...).load_async().
+    Pi reads go through the async mongo driver when one is available, and
+    downloads, log parsing and the CPU heavy steps run in the default
+    executor, so the event loop stays free. Concurrent loads of the same
+    window share one read, see read_window_async, and concurrent calls on
+    the same instance all wait for the one load.
+
+    returns self.
+    """
+    async def load_async(self):
+        import asyncio
+        if self.load_task is None:
+            if not self.load_pending:
+                return self
+            self.load_task = asyncio.ensure_future(self.run_load_async())
+            self.load_task.add_done_callback(
+                lambda done: setattr(self, 'load_task', None))
+        # One caller being cancelled mustn't cancel the others' load
+        await asyncio.shield(self.load_task)
+        return self
+
+    async def run_load_async(self):
+        import asyncio
+        self.load_pending = False
+        loop = asyncio.get_running_loop()
+        try:
+            if self.data_source == 'WEL':
+                await loop.run_in_executor(None, self.refresh_db)
+                if self.WEL_download:
+                    await loop.run_in_executor(None,
+                                               self.download_current_log)
+            elif self.mongo_db is None:
+                # Same server both ways, the sync client backs bucketed
+                # loads, refresh and reads in the executor without an async
+                # driver. Neither connects until used.
+                if self.async_mongo_db is None:
+                    self.async_mongo_db = mongoConnectAsync()
+                    self.mongo_db = mongoConnect()
+                else:
+                    self.mongo_db = mongoConnectSync(self.async_mongo_db)
+
+            bucket = self.bucket_size()
+            if bucket is not None:
+                await loop.run_in_executor(None, self.stitch)
+                return self
+            with self.timer('stitch'):
+                data = await self.read_window_async(*self.timerange)
+                if self.data_source == 'WEL':
+                    data = data[(data.index > self.timerange[0])
+                                & (data.index < self.timerange[1])]
+                elif len(data) == 0:
+                    raise Exception("No data came back from mongo server.")
+                self.loaded = data
+                await loop.run_in_executor(None, self.finish_stitch, bucket)
+        except BaseException:
+            self.load_pending = True
+            raise
+        return self
+
+    """
+    Async read_window. Concurrent reads of the same source and window share
+    one in-flight read, each caller getting its own copy.
+    """
+    async def read_window_async(self,
+                                start,
+                                end):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        for old in [old for old in self.inflight_loads if old.is_closed()]:
+            self.inflight_loads.pop(old, None)
+        loads = self.inflight_loads.setdefault(loop, {})
+        key = (self.window_key(), start, end)
+        task = loads.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.share_window_async(start, end))
+            loads[key] = task
+
+            def forget(done):
+                loads.pop(key, None)
+                if len(loads) == 0:
+                    self.inflight_loads.pop(loop, None)
+            task.add_done_callback(forget)
+        # One caller being cancelled mustn't cancel the others' read
+        data = await asyncio.shield(task)
+        return data.copy()
+
+    async def share_window_async(self,
+                                 start,
+                                 end):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self.data_source == 'WEL' or self.async_mongo_db is None:
+            return await loop.run_in_executor(None, self.read_window,
+                                              start, end)
+        if self.segment_cache is None:
+            return await self.fetch_window_async(start, end)
+
+        while True:
+            gaps = self.segment_cache.gaps(self.window_key(), start, end)
+            frames = await asyncio.gather(*[self.fetch_window_async(*gap)
+                                            for gap in gaps])
+            fetched = list(zip(gaps, frames))
+
+            def fetch(gap_start, gap_end):
+                for (fetch_start, fetch_end), frame in fetched:
+                    if fetch_start <= gap_start and gap_end <= fetch_end:
+                        return frame.loc[gap_start:gap_end]
+                raise LookupError
+            try:
+                return self.segment_cache.get(self.window_key(), start, end,
+                                              fetch)
+            except LookupError:
+                # A segment was evicted while fetching, plan again
+                continue
+
+    """
+    Async fetch_window for Pi mode, through async_mongo_db.
+    """
+    async def fetch_window_async(self,
+                                 start,
+                                 end):
+        import asyncio
+        collection = self.async_mongo_db.data
+        if self.mongo_hint is None:
+            self.mongo_hint = ('dateandtime_1'
+                               in await collection.index_information())
+        cursor = collection.find(self.window_query(start, end),
+                                 self.mongo_projection(),
+                                 batch_size=self.mongo_batch)
+        if self.mongo_hint:
+            cursor = cursor.hint([('dateandtime', 1)])
+        with self.timer('read_mongo'):
+            # Fill the arrays as batches arrive rather than listing every
+            # document first, as read_cursor does
+            rows = DocumentArrays(self.mongo_batch)
+            async for doc in cursor.sort('dateandtime', 1):
+                rows.append(doc)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.cursor_frame, rows)
+
+    """
+    Context manager timing a block as a stage in stats, or doing nothing when
+    stats is None.
+    """
+    def timer(self,
+              name):
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.timer(name)
+
+    """
+    Download this month's log, which is still being written on the server,
+    over the copy in the db.
+    """
+    def download_current_log(self):
+        from wget import download
+        dat_url = ("http://www.welserver.com/WEL1060/"
+                   + F"WEL_log_{self.now.year}"
+                   + F"_{self.now.month:02d}.xls")
+        downfilepath = (self.dl_db_path
+                        + F"WEL_log_{self.now.year}"
+                        + F"_{self.now.month:02d}.xls")
+        downfile = download(dat_url, downfilepath)
+        print()
+        if os.path.exists(downfilepath):
+            move(downfile, downfilepath)
 
     def time_from_args(self,
                        arg_string=None):
@@ -109,75 +1521,288 @@ class WELData:
         return self.timeCondition(timerange)
 
     """
-    From a filepath, load that data.
-    Columns with all NaNs are dropped.
+    From a filepath, load that data.
+    Columns with all NaNs are dropped.
+    The parsed month is cached next to the log file and reused until the log
+    file changes (see cache_logs).
+
+    ADDED COLUMNS:
+    dateandtime : combined datetime object for each row.
+    power_tot : TAH_W + HP_W
+    T_diff : living_T - outside_T
+    eff_ma : day length rolling average of efficiency
+
+    filepath : filepath for data file.
+    keepdata : boolean keep downloaded data file. Default False.
+    """
+    def read_log(self,
+                 filepath):
+        data = self.read_raw_log(filepath)
+        data = pd.concat((data, self.calced_cols(data)), axis=1)
+
+        return data
+
+    """
+    Load a WEL log file, from its cache if possible, indexed by time in
+    to_tzone but without the calculated columns.
+
+    filepath : filepath for data file.
+    """
+    @profiled('read_log')
+    def read_raw_log(self,
+                     filepath):
+        data = self.load_log_cache(filepath)
+        if data is None:
+            data = self.parse_log(filepath)
+            self.write_log_cache(filepath, data)
+
+        data.index = data['dateandtime']
+        data = data.tz_localize(tz.gettz('EST'))
+        data = data.tz_convert(self.to_tzone)
+
+        return data
+
+    """
+    Parse a raw WEL log file into typed columns, with the logged timestamps in
+    a naive 'dateandtime' column.
+
+    filepath : filepath for data file.
+    """
+    @profiled('parse_log')
+    def parse_log(self,
+                  filepath):
+        try:
+            data = pd.read_excel(filepath)
+        except Exception:
+            data = pd.read_csv(filepath, sep='\t',
+                               index_col=False, na_values=['?'])
+
+        for col in data.columns:
+            if ('Date' not in col) and ('Time' not in col):
+                data[col] = data[col].astype(np.float64)
+
+        data['dateandtime'] = self.parse_datetime(data.Date, data.Time)
+        data = data.drop(columns=['Date', 'Time'])
+        data = self.compact_status(data)
+
+        return data
+
+    """
+    Store status channels (names ending in _b) as uint8 on/off values with
+    the plotting offset removed. Missing samples count as off.
+
+    frame : frame to convert, modified in place.
+    """
+    def compact_status(self,
+                       frame):
+        for col in frame.columns:
+            if col.endswith('_b') and frame[col].dtype != np.uint8:
+                frame[col] = (frame[col].fillna(0) % 2).astype(np.uint8)
+        return frame
+
+    """
+    Path of the parsed month cache sitting next to a WEL log file.
+    """
+    def log_cache_path(self,
+                       filepath):
+        return os.path.splitext(filepath)[0] + '.feather'
+
+    """
+    Stamp of the source log file, stored in the cache to detect changes.
+    """
+    def log_source_stamp(self,
+                         filepath):
+        stat = os.stat(filepath)
+        return {b'source_mtime_ns': str(stat.st_mtime_ns).encode(),
+                b'source_size': str(stat.st_size).encode(),
+                b'cache_version': str(self.log_cache_version).encode()}
 
-    ADDED COLUMNS:
-    dateandtime : combined datetime object for each row.
-    power_tot : TAH_W + HP_W
-    T_diff : living_T - outside_T
-    eff_ma : day length rolling average of efficiency
+    """
+    Load a parsed month from its memory-mapped cache file.
 
-    filepath : filepath for data file.
-    keepdata : boolean keep downloaded data file. Default False.
+    returns None if caching is disabled or the cache is missing or stale.
     """
-    def read_log(self,
-                 filepath):
+    def load_log_cache(self,
+                       filepath):
+        if not self.cache_logs or feather is None:
+            return None
+        cache_path = self.log_cache_path(filepath)
+        if not os.path.exists(cache_path):
+            return None
         try:
-            data = pd.read_excel(filepath)
+            table = feather.read_table(cache_path, memory_map=True)
+            metadata = table.schema.metadata or {}
+            stamp = self.log_source_stamp(filepath)
+            if any(metadata.get(key) != value
+                   for key, value in stamp.items()):
+                return None
+            return table.to_pandas()
         except Exception:
-            data = pd.read_csv(filepath, sep='\t',
-                               index_col=False, na_values=['?'])
+            return None
 
-        for col in data.columns:
-            if ('Date' not in col) and ('Time' not in col):
-                data[col] = data[col].astype(np.float64)
+    """
+    Store a parsed month as an uncompressed feather file so later loads can
+    memory-map it.
+    """
+    def write_log_cache(self,
+                        filepath,
+                        data):
+        if not self.cache_logs or feather is None:
+            return
+        cache_path = self.log_cache_path(filepath)
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}),
+             **self.log_source_stamp(filepath)})
+        try:
+            feather.write_feather(table, cache_path + '.tmp',
+                                  compression='uncompressed')
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError:
+            print(F'Could not write log cache {cache_path}')
 
-        data.Date = data.Date.apply(lambda date:
-                                    dt.datetime.strptime(date, "%m/%d/%Y"))
-        data.Time = data.Time.apply(lambda time:
-                                    dt.datetime.strptime(time,
-                                                         "%H:%M:%S").time())
+    """
+    Combine WEL log date and time string columns into timestamps in a single
+    vectorized pass. Returns naive datetimes as logged by the WEL.
+    A month of logs only has a few dozen distinct dates and at most 86400
+    distinct times, so each unique string is parsed once.
 
-        data['dateandtime'] = [dt.datetime.combine(date, time)
-                               for date, time in zip(data.Date,
-                                                     data.Time)]
-        data.index = data['dateandtime']
-        data = data.tz_localize(tz.gettz('EST'))
-        data = data.tz_convert(self.to_tzone)
-        data.drop(columns=['Date', 'Time'])
+    date : series of date strings formatted as mm/dd/YYYY.
+    time : series of time strings formatted as HH:MM:SS.
+    """
+    def parse_datetime(self,
+                       date,
+                       time):
+        days = pd.to_datetime(date.astype(str), format="%m/%d/%Y", cache=True)
+        codes, uniq = pd.factorize(time.astype(str))
+        offsets = pd.to_timedelta(uniq)[codes]
+        return days.to_numpy() + offsets.to_numpy()
 
-        data = pd.concat((data, self.calced_cols(data)), axis=1)
+    """
+    Calculate derived columns for a frame.
 
-        return data
+    frame : frame holding the columns to derive from.
+    optional names : derived columns to calculate. Defaults to every derived
+                     column whose channels are in the frame.
+    optional head : for a frame whose power columns are already shifted,
+                    the first row's power readings, see logged_power.
 
+    returns frame of the derived columns only.
+    """
+    @profiled('calced_cols')
     def calced_cols(self,
-                    frame):
-        out_frame = pd.DataFrame()
-
-        # Additional calculated columns
-        out_frame['T_diff'] = frame.living_T - frame.outside_T
-        cops = (((1.15 * 0.37 * frame.TAH_fpm)
-                * (np.abs(frame.TAH_out_T - frame.TAH_in_T)))
-                / (frame.HP_W / 1000))
-        cops[cops > 12] = np.nan
-        out_frame['COP'] = cops
-        well_gpm = 13.6
-        out_frame['well_W'] = ((well_gpm * 0.0630902) * 4.186
-                               * (np.abs(frame.loop_out_T - frame.loop_in_T)))
-        well_COP = out_frame.well_W / (frame.HP_W / 1000)
-        well_COP[well_COP > 10] = np.nan
-        out_frame['well_COP'] = well_COP
+                    frame,
+                    names=None,
+                    head=None):
+        if names is None:
+            names = list(derived_cols)
+        out = {}
+        logged = {}
+        if head is not None:
+            logged = self.logged_power(frame, head)
+        # ChainMap lets derived columns use ones calculated before them
+        view = ChainMap(out, logged, frame)
+        available = [col for col in frame.columns if col not in names]
+        for name in self.derive_order(names, available):
+            deps, func = derived_cols[name]
+            out[name] = func(view)
 
+        out_frame = pd.DataFrame(index=frame.index)
+        for name in names:
+            if name in out:
+                out_frame[name] = out[name]
         return out_frame
 
+    """
+    Power readings as logged, for a frame whose power columns have been
+    shifted back one sample. Derived columns are calculated from these, as
+    they always were before the shift. Each row's reading is the shifted
+    value of the row before it, and the first row's is head.
+
+    frame : frame with shifted power columns.
+    head : dict of the first row's power readings, by column.
+
+    returns dict of series.
+    """
+    def logged_power(self,
+                     frame,
+                     head):
+        logged = {}
+        for col, value in head.items():
+            if col in frame.columns and len(frame) > 0:
+                reading = frame[col].shift(1)
+                reading.iloc[0] = value
+                logged[col] = reading
+        return logged
+
+    """
+    Order derived columns so each comes after the derived columns it uses,
+    leaving out any that can't be calculated from the available columns.
+
+    names : derived column names.
+    available : column names already present.
+    """
+    def derive_order(self,
+                     names,
+                     available):
+        order = []
+
+        def visit(name):
+            if name in order:
+                return True
+            if name in available:
+                return True
+            if name not in derived_cols:
+                return False
+            if not all([visit(dep) for dep in derived_cols[name][0]]):
+                return False
+            order.append(name)
+            return True
+
+        [visit(name) for name in names]
+        return order
+
+    """
+    Add derived columns to data the first time they are needed. Columns that
+    are already there are left alone.
+
+    names : column names, names which are not derived columns are ignored.
+
+    returns list of columns that were added.
+    """
+    def derive(self,
+               names):
+        names = [name for name in names
+                 if name in derived_cols and name not in self.data.columns]
+        if len(names) == 0:
+            return []
+        new_cols = self.calced_cols(self.data, names, head=self.power_head)
+        for name in new_cols.columns:
+            self.data[name] = new_cols[name]
+        return list(new_cols.columns)
+
+    """
+    Channels that need to be loaded for a list of column names, with
+    derived columns replaced by the channels they are calculated from.
+    """
+    def source_cols(self,
+                    columns):
+        source = []
+        for col in columns:
+            if col in derived_cols:
+                deps = self.source_cols(derived_cols[col][0])
+            else:
+                deps = [col]
+            for dep in deps:
+                if dep not in source:
+                    source.append(dep)
+        return source
+
     """
     Check if the last month's log has been downloaded, and download if not.
 
     month : specify month to download to db. If no month is specified, download
             the previous month.
-
-    returns a string with the downloaded month.
     """
     def check_dl_db(self,
                     month=None,
@@ -186,40 +1811,23 @@ class WELData:
             os.mkdir(self.dl_db_path)
         if month is None:
             month = self.now - relativedelta(months=1)
-        prev_url = ('http://www.welserver.com/WEL1060/'
-                    F'WEL_log_{month.year}_{month.month:02d}.zip')
-        prev_db_path_zip = (self.dl_db_path + F'WEL_log_{month.year}'
-                                              F'_{month.month:02d}.zip')
-        prev_db_path_xls = (self.dl_db_path + F'WEL_log_{month.year}'
-                                              F'_{month.month:02d}.xls')
-        if (not os.path.exists(prev_db_path_xls)) or forcedl:
-            try:
-                # print(prev_db_path_zip)
-                print(F'{month.year}-{month.month}:')
-                download(prev_url, prev_db_path_zip)
-                print()
-                os.system(F'unzip {prev_db_path_zip} -d {self.dl_db_path}'
-                          F';rm {prev_db_path_zip}')
-                print()
-            except Exception:
-                print('Not available for download')
+        LogSync(self.dl_db_path).sync_month(month, forcedl=forcedl)
 
     """
-    Redownload all months since 2020-3-1 to db.
+    Download all months since 2020-3-1 missing from the db.
+
+    forcedl : redownload every month, even if already in the db.
     """
     def refresh_db(self,
                    forcedl=False):
-        first = dt.date(2020, 3, 1)
-        num_months = ((self.now.year - first.year) * 12
-                      + self.now.month - first.month)
-        monthlist = [first + relativedelta(months=x)
-                     for x in range(num_months + 1)]
-        [self.check_dl_db(month=month, forcedl=forcedl) for month in monthlist]
+        LogSync(self.dl_db_path).sync(self.now, forcedl=forcedl)
 
     """
     Load correct months of data based on timerange.
     """
+    @profiled('stitch')
     def stitch(self):
+        bucket = self.bucket_size()
         if self.data_source == 'WEL':
             load_new = False
             if self.data is not None:
@@ -229,53 +1837,815 @@ class WELData:
             else:
                 load_new = True
             if load_new:
-                num_months = ((self.timerange[1].year - self.timerange[0].year)
-                              * 12 + self.timerange[1].month
-                              - self.timerange[0].month)
-                monthlist = [self.timerange[0] + relativedelta(months=x)
-                             for x in range(num_months + 1)]
-                loadedstring = [F'{month.year}-{month.month}'
-                                for month in monthlist]
-                print(F'loaded: {loadedstring}')
-                datalist = [self.read_log(self.dl_db_path
-                                          + F'WEL_log_{month.year}'
-                                          + F'_{month.month:02d}.xls')
-                            for month in monthlist]
-                # print(datalist)
-                self.data = pd.concat(datalist)
-                tmask = ((self.data.index > self.timerange[0])
-                         & (self.data.index < self.timerange[1]))
-                self.data = self.data[tmask]
+                self.loaded = self.read_window(*self.timerange)
+                tmask = ((self.loaded.index > self.timerange[0])
+                         & (self.loaded.index < self.timerange[1]))
+                self.loaded = self.loaded[tmask]
 
         if self.data_source == 'Pi':
-            query = {'dateandtime': {'$gte': self.timerange[0]
-                                     .astimezone(self.db_tzone),
-                                     '$lte': self.timerange[1]
-                                     .astimezone(self.db_tzone)}}
-            # print(F"#DEBUG: query: {query}")
-            self.data = pd.DataFrame(list(self.mongo_db.data.find(query)))
+            if bucket is None:
+                self.loaded = self.read_window(*self.timerange)
+            else:
+                self.loaded = self.read_mongo_buckets(
+                    self.window_query(*self.timerange), bucket)
             if len(self.data) == 0:
                 raise Exception("No data came back from mongo server.")
-            self.data.index = self.data['dateandtime']
-            self.data.drop(columns=['dateandtime'], inplace=True)
-            # print(self.data.columns)
-            self.data = self.data.tz_localize(self.db_tzone)
-            self.data = self.data.tz_convert(self.to_tzone)
             # print(F"#DEBUG: timerange from: {self.data.index[-1]}"
             #       "to {self.data.index[0]}")
-            # For now, calculate columns at data load
-            self.data = pd.concat((self.data, self.calced_cols(self.data)),
-                                  axis=1)
+        self.finish_stitch(bucket)
+
+    """
+    Power shift, downsample and index freshly loaded data.
+
+    bucket : bucket size data was loaded at, see bucket_size.
+    """
+    def finish_stitch(self,
+                      bucket):
+        # Shift power meter data by one sample for better alignment with
+        # others. Server-side buckets are already coarser than the shift.
+        self.power_head = None
+        if bucket is None or self.data_source == 'WEL':
+            power = [col for col in self.power_cols
+                     if col in self.data.columns]
+            if len(self.data) > 0:
+                self.power_head = {col: self.data[col].iloc[0]
+                                   for col in power}
+            for col in power:
+                self.data[col] = self.data[col].shift(-1)
+
+        if bucket is not None and self.data_source == 'WEL':
+            # Buckets of derived columns need every sample
+            self.derive(list(derived_cols))
+            self.loaded = self.downsample(self.data, bucket)
+            self.power_head = None
+        self.build_intervals()
+        self.data_version += 1
+
+    """
+    Raw rows between start and end, from segment_cache when it is enabled.
+    """
+    def read_window(self,
+                    start,
+                    end):
+        if self.segment_cache is None:
+            return self.fetch_window(start, end)
+        return self.segment_cache.get(self.window_key(), start, end,
+                                      self.fetch_window)
+
+    """
+    Key identifying the source of read_window, for segment_cache. In WEL
+    mode it includes the stamp of this month's log, so segments read before
+    it was downloaded again aren't used.
+    """
+    def window_key(self):
+        if self.data_source == 'WEL':
+            now = dt.datetime.now().astimezone(self.to_tzone)
+            filepath = (self.dl_db_path + F'WEL_log_{now.year}'
+                        + F'_{now.month:02d}.xls')
+            stamp = None
+            if os.path.exists(filepath):
+                stat = os.stat(filepath)
+                stamp = (stat.st_mtime_ns, stat.st_size)
+            return ('WEL', os.path.abspath(self.dl_db_path),
+                    repr(self.to_tzone), stamp)
+        columns = None if self.columns is None else tuple(self.columns)
+        mongo_db = self.async_mongo_db if self.mongo_db is None \
+            else self.mongo_db
+        return ('Pi', mongo_db, columns, repr(self.to_tzone))
+
+    """
+    Read the raw rows between start and end inclusive from the source,
+    without power shift or calculated columns.
+    """
+    def fetch_window(self,
+                     start,
+                     end):
+        if self.data_source == 'Pi':
+            return self.read_mongo(self.window_query(start, end))
+
+        num_months = ((end.year - start.year) * 12
+                      + end.month - start.month)
+        monthlist = [start + relativedelta(months=x)
+                     for x in range(num_months + 1)]
+        loadedstring = [F'{month.year}-{month.month}'
+                        for month in monthlist]
+        print(F'loaded: {loadedstring}')
+        filelist = [self.dl_db_path + F'WEL_log_{month.year}'
+                    + F'_{month.month:02d}.xls'
+                    for month in monthlist]
+        if self.load_workers > 1 and len(filelist) > 1:
+            workers = min(self.load_workers, len(filelist))
+            with ProcessPoolExecutor(max_workers=workers) as pool, \
+                    self.timer('read_log'):
+                datalist = list(pool.map(
+                    read_log_worker, filelist,
+                    [self.cache_logs] * len(filelist),
+                    [self.to_tzone] * len(filelist)))
+        else:
+            datalist = [self.read_raw_log(filepath)
+                        for filepath in filelist]
+        data = pd.concat(datalist)
+        return data[(data.index >= start) & (data.index <= end)]
+
+    """
+    Mongo query for the rows between start and end inclusive.
+    """
+    def window_query(self,
+                     start,
+                     end):
+        return {'dateandtime': {'$gte': start.astimezone(self.db_tzone),
+                                '$lte': end.astimezone(self.db_tzone)}}
+
+    """
+    Index the on-runs of every status channel in data as row positions.
+    """
+    def build_intervals(self):
+        self.intervals = {col: runEdges(self.data[col])
+                          for col in self.data.columns if col.endswith('_b')}
+
+    """
+    Extend the on-run index with rows appended to data, joining runs that
+    carry on across the old end.
+
+    old_len : number of rows before the append.
+    """
+    def append_intervals(self,
+                         old_len):
+        if self.intervals is None:
+            return self.build_intervals()
+        for col in self.data.columns:
+            if not col.endswith('_b'):
+                continue
+            starts, stops = runEdges(self.data[col].iloc[old_len:])
+            starts, stops = starts + old_len, stops + old_len
+            old_starts, old_stops = self.intervals.get(col, ([], []))
+            if (len(old_stops) > 0 and len(starts) > 0
+                    and old_stops[-1] == old_len and starts[0] == old_len):
+                starts = starts[1:]
+                old_stops = np.append(old_stops[:-1], stops[0])
+                stops = stops[1:]
+            self.intervals[col] = (np.append(old_starts, starts).astype(int),
+                                   np.append(old_stops, stops).astype(int))
+
+    """
+    Move the on-run index after rows were dropped from the start of data.
+
+    count : number of rows dropped.
+    """
+    def drop_intervals(self,
+                       count):
+        if count == 0 or self.intervals is None:
+            return
+        for col, (starts, stops) in self.intervals.items():
+            keep = stops > count
+            self.intervals[col] = (np.maximum(starts[keep] - count, 0),
+                                   stops[keep] - count)
+
+    """
+    Start and end times of every on-run of a status channel. A run ends at
+    the first sample after it, or at the last sample if it is still on.
+
+    channel : status channel name.
+
+    returns frame with start, end and duration columns.
+    """
+    def onIntervals(self,
+                    channel):
+        starts, stops = self.intervals[channel]
+        index = self.data.index
+        ends = index[np.minimum(stops, len(index) - 1)]
+        return pd.DataFrame({'start': index[starts], 'end': ends,
+                             'duration': ends - index[starts]})
+
+    """
+    Number of on-runs of a status channel.
+    """
+    def cycleCount(self,
+                   channel):
+        return len(self.intervals[channel][0])
+
+    """
+    Durations of every on-run of a status channel.
+    """
+    def cycleLengths(self,
+                     channel):
+        return self.onIntervals(channel).duration
+
+    """
+    Fraction of the loaded time a status channel was on.
+    """
+    def dutyCycle(self,
+                  channel):
+        span = self.data.index[-1] - self.data.index[0]
+        if span.total_seconds() == 0:
+            return np.nan
+        return self.cycleLengths(channel).sum() / span
+
+    """
+    Aggregate an expression over each on-run of a status channel.
+
+    channel : status channel name.
+    expr : column name or expression, as for plotVar.
+    optional how : 'mean', 'sum', 'min' or 'max'. NaNs are ignored.
+
+    returns onIntervals frame with the aggregate in a column named expr.
+    """
+    def cycleStats(self,
+                   channel,
+                   expr,
+                   how='mean'):
+        starts, stops = self.intervals[channel]
+        out = self.onIntervals(channel)
+        if len(starts) == 0:
+            out[expr] = pd.Series(dtype=np.float64)
+            return out
+        values = np.asarray(self.evalExpr(expr), dtype=np.float64)
+        # reduceat needs every boundary inside the array
+        values = np.append(values, np.nan)
+        bounds = np.column_stack((starts, stops)).ravel()
+        valid = ~np.isnan(values)
+        if how in ('mean', 'sum'):
+            sums = np.add.reduceat(np.where(valid, values, 0.), bounds)[::2]
+            if how == 'mean':
+                counts = np.add.reduceat(valid.astype(int), bounds)[::2]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    sums = sums / counts
+            out[expr] = sums
+        elif how == 'min':
+            out[expr] = np.fmin.reduceat(values, bounds)[::2]
+        elif how == 'max':
+            out[expr] = np.fmax.reduceat(values, bounds)[::2]
+        else:
+            raise ValueError(F"Unknown aggregate '{how}'")
+        return out
+
+    """
+    Rows of a series during the on-runs of a status channel, with a NaN at
+    the end of each run so plotted lines break between runs. Only the on rows
+    are gathered, no full length mask is made.
+
+    datum : series aligned with data.
+    channel : status channel name.
+    """
+    def maskIntervals(self,
+                      datum,
+                      channel):
+        starts, stops = self.intervals[channel]
+        lengths = stops - starts
+        rows = (np.arange(lengths.sum())
+                + np.repeat(starts - np.cumsum(lengths) + lengths, lengths))
+        breaks = stops[stops < len(datum)]
+        taken = datum.iloc[rows]
+        gaps = pd.Series(np.nan, index=datum.index[breaks])
+        return pd.concat((taken, gaps)).sort_index(kind='stable')
+
+    """
+    Raw time ordered chunks of timerange, straight from the source: one
+    month file at a time in WEL mode, or rows cursor batches in Pi mode.
+    Power data is not shifted yet.
+    """
+    def raw_chunks(self,
+                   rows):
+        if self.data_source == 'WEL':
+            num_months = ((self.timerange[1].year - self.timerange[0].year)
+                          * 12 + self.timerange[1].month
+                          - self.timerange[0].month)
+            for x in range(num_months + 1):
+                month = self.timerange[0] + relativedelta(months=x)
+                frame = self.read_raw_log(self.dl_db_path
+                                          + F'WEL_log_{month.year}'
+                                          + F'_{month.month:02d}.xls')
+                yield frame[(frame.index > self.timerange[0])
+                            & (frame.index < self.timerange[1])]
+        elif self.data_source == 'Pi':
+            query = {'dateandtime': {'$gte': self.timerange[0]
+                                     .astimezone(self.db_tzone),
+                                     '$lte': self.timerange[1]
+                                     .astimezone(self.db_tzone)}}
+            cursor = self.mongo_cursor(query)
+            while True:
+                frame = self.read_cursor(cursor, rows, limit=rows)
+                if len(frame) == 0:
+                    break
+                yield frame
+                if len(frame) < rows:
+                    break
+
+    """
+    Stream timerange as time ordered chunks without holding it all in
+    memory. Chunks come out as stitch would load them: the last row of each
+    chunk is held back until the next chunk's first power reading arrives,
+    so the HP_W/TAH_W shift is exact across chunk boundaries. The first
+    row's power readings before the shift are in chunk.attrs['power_head'],
+    for calculating derived columns, see logged_power.
+
+    optional rows : rows per chunk in Pi mode, default mongo_batch. WEL mode
+                    always streams by month.
+    optional overlap : timedelta of rows from the end of the previous chunk
+                       to repeat at the start of each chunk, so rolling
+                       windows up to that length are complete. The number
+                       of repeated rows is in chunk.attrs['context'].
+    """
+    def chunks(self,
+               rows=None,
+               overlap=None):
+        if rows is None:
+            rows = self.mongo_batch
+        held = None
+        context = None
+        context_head = None
+        for raw in self.raw_chunks(rows):
+            if len(raw) == 0:
+                continue
+            if held is not None:
+                raw = pd.concat((held, raw))
+            held = raw.iloc[-1:]
+            power = [col for col in self.power_cols if col in raw.columns]
+            chunk = raw.copy()
+            for col in power:
+                chunk[col] = chunk[col].shift(-1)
+            chunk = chunk.iloc[:-1]
+            if len(chunk) == 0:
+                continue
+            head = {col: raw[col].iloc[0] for col in power}
+            yield self.with_context(chunk, context, head, context_head)
+            if overlap is not None:
+                context = chunk[chunk.index > chunk.index[-1] - overlap]
+                start = len(chunk) - len(context)
+                context_head = {col: raw[col].iloc[start] for col in power}
+        if held is not None:
+            chunk = held.copy()
+            power = [col for col in self.power_cols if col in chunk.columns]
+            head = {col: chunk[col].iloc[0] for col in power}
+            for col in power:
+                chunk[col] = np.nan
+            yield self.with_context(chunk, context, head, context_head)
+
+    def with_context(self,
+                     chunk,
+                     context,
+                     head,
+                     context_head):
+        if context is not None:
+            chunk = pd.concat((context, chunk))
+            chunk.attrs['context'] = len(context)
+            chunk.attrs['power_head'] = context_head
+        else:
+            chunk.attrs['context'] = 0
+            chunk.attrs['power_head'] = head
+        return chunk
+
+    """
+    Stream an expression over timerange chunk by chunk, as plotVar would
+    evaluate it on a full load.
+
+    expr : expression string, as for plotVar.
+    optional statusmask : status mask expression.
+    optional overlap : context to carry between chunks, at least as long as
+                       any rolling window in expr.
+    optional rows : rows per chunk in Pi mode.
+
+    yields series for each chunk, without the context rows.
+    """
+    def streamExpr(self,
+                   expr,
+                   statusmask=None,
+                   overlap=None,
+                   rows=None):
+        for chunk in self.chunks(rows=rows, overlap=overlap):
+            head = chunk.attrs['power_head']
+            result = self.evalFrame(chunk, expr, head=head)
+            if statusmask is not None:
+                smask = np.asarray(self.evalFrame(chunk, statusmask,
+                                                  mask=True, head=head),
+                                   dtype=bool)
+                result = result.where(smask)
+            yield result.iloc[chunk.attrs['context']:]
+
+    """
+    Mean of an expression over timerange, with memory bounded by the chunk
+    size. Infinite values are ignored along with NaNs.
+
+    Takes the same arguments as streamExpr.
+    """
+    def streamMean(self,
+                   expr,
+                   statusmask=None,
+                   overlap=None,
+                   rows=None):
+        total = 0.
+        count = 0
+        for result in self.streamExpr(expr, statusmask=statusmask,
+                                      overlap=overlap, rows=rows):
+            values = np.asarray(result, dtype=np.float64)
+            finite = np.isfinite(values)
+            total += values[finite].sum()
+            count += np.count_nonzero(finite)
+        return total / count if count > 0 else np.nan
+
+    """
+    Bucket length for resolution-aware loads: the timerange split into one
+    bucket per pixel of the target width, in whole seconds.
+
+    returns None if no resolution is set or the buckets would hold fewer than
+    two samples, in which case full resolution data is loaded.
+    """
+    def bucket_size(self):
+        if self.resolution is None:
+            return None
+        span = self.timerange[1] - self.timerange[0]
+        bucket = dt.timedelta(seconds=math.ceil(span.total_seconds()
+                                                / self.resolution))
+        if bucket < 2 * self.sample_period:
+            return None
+        return bucket
+
+    """
+    Interleave per-bucket minimum and maximum frames into one frame with two
+    rows per bucket, at the bucket start and middle. Plotted as a line this
+    draws the full envelope of each bucket, so spikes survive and status
+    channels keep every bucket in which they switched.
+
+    lo, hi : frames of bucket minima and maxima indexed by bucket start.
+    bucket : bucket length.
+    """
+    def minmax_frame(self,
+                     lo,
+                     hi,
+                     bucket):
+        hi = hi.copy()
+        hi.index = hi.index + bucket / 2
+        return self.compact_status(pd.concat((lo, hi))
+                                   .sort_index(kind='stable'))
+
+    """
+    Reduce a full resolution frame to the min/max envelope of fixed buckets.
+
+    frame : frame to downsample.
+    bucket : bucket length.
+    """
+    def downsample(self,
+                   frame,
+                   bucket):
+        resampled = frame.resample(bucket, origin='epoch')
+        lo = resampled.min().dropna(how='all')
+        hi = resampled.max().dropna(how='all')
+        return self.minmax_frame(lo, hi, bucket)
+
+    """
+    Run a query on the mongo data collection aggregated into buckets on the
+    server, returning the min/max envelope of each channel. Calculated columns
+    come from the bucket means.
+
+    query : mongo query document.
+    bucket : bucket length.
+    """
+    @profiled('read_mongo')
+    def read_mongo_buckets(self,
+                           query,
+                           bucket):
+        if self.columns is not None:
+            channels = self.source_cols(self.columns)
+        else:
+            first = self.mongo_db.data.find_one(query, {'_id': 0})
+            if first is None:
+                return pd.DataFrame()
+            channels = [key for key in first if key != 'dateandtime']
+
+        epoch_ms = {'$subtract': ['$dateandtime', dt.datetime(1970, 1, 1)]}
+        bucket_ms = int(bucket.total_seconds() * 1000)
+        group = {'_id': {'$subtract': [epoch_ms,
+                                       {'$mod': [epoch_ms, bucket_ms]}]}}
+        for col in channels:
+            group[col + '__min'] = {'$min': '$' + col}
+            group[col + '__max'] = {'$max': '$' + col}
+            group[col + '__mean'] = {'$avg': '$' + col}
+        pipeline = [{'$match': query},
+                    {'$group': group},
+                    {'$sort': {'_id': 1}}]
+        frame = pd.DataFrame(list(self.mongo_db.data.aggregate(
+            pipeline, allowDiskUse=True)))
+        if len(frame) == 0:
+            return frame
+
+        frame.index = pd.to_datetime(frame.pop('_id').astype(np.int64),
+                                     unit='ms').rename('dateandtime')
+        frame = frame.astype(np.float64)
+        frame = frame.tz_localize(self.db_tzone)
+        frame = frame.tz_convert(self.to_tzone)
+
+        def stat(suffix):
+            return frame[[col + suffix for col in channels]].rename(
+                columns=lambda col: col[:-len(suffix)])
+        mean = stat('__mean')
+        calc = self.calced_cols(mean)
+        lo = pd.concat((stat('__min'), calc), axis=1)
+        hi = pd.concat((stat('__max'), calc), axis=1)
+        return self.minmax_frame(lo, hi, bucket)
+
+    """
+    Run a query on the mongo data collection and return the matching rows
+    indexed by time in to_tzone, without the calculated columns.
+
+    query : mongo query document.
+    """
+    @profiled('read_mongo')
+    def read_mongo(self,
+                   query):
+        cursor = self.mongo_cursor(query)
+        return self.read_cursor(cursor, self.mongo_batch)
+
+    """
+    Mongo projection of the channels in columns, and dateandtime.
+    """
+    def mongo_projection(self):
+        projection = {'_id': 0}
+        if self.columns is not None:
+            projection['dateandtime'] = 1
+            projection.update({col: 1
+                               for col in self.source_cols(self.columns)})
+        return projection
+
+    """
+    Time sorted cursor over the mongo data collection for a query, projected
+    to the channels in columns and hinted with the dateandtime index when the
+    collection has one.
+
+    query : mongo query document.
+    """
+    def mongo_cursor(self,
+                     query):
+        projection = self.mongo_projection()
+        if self.mongo_hint is None:
+            self.mongo_hint = ('dateandtime_1'
+                               in self.mongo_db.data.index_information())
+        cursor = self.mongo_db.data.find(query, projection,
+                                         batch_size=self.mongo_batch)
+        if self.mongo_hint:
+            cursor = cursor.hint([('dateandtime', 1)])
+        return cursor.sort('dateandtime', 1)
+
+    """
+    Read documents from a cursor into a frame indexed by time in to_tzone.
+
+    cursor : mongo cursor, left positioned after the last document read.
+    size : number of documents to preallocate for, grown as needed.
+    optional limit : stop after this many documents.
+    """
+    def read_cursor(self,
+                    cursor,
+                    size,
+                    limit=None):
+        rows = DocumentArrays(size)
+        for doc in cursor:
+            rows.append(doc)
+            if rows.count == limit:
+                break
+        return self.cursor_frame(rows)
+
+    """
+    Frame indexed by time in to_tzone from documents read into arrays.
+
+    rows : DocumentArrays.
+    """
+    def cursor_frame(self,
+                     rows):
+        frame = rows.frame()
+        if len(frame) == 0:
+            return frame
+        frame = frame.tz_localize(self.db_tzone)
+        frame = frame.tz_convert(self.to_tzone)
+        return self.compact_status(frame)
+
+    """
+    Append rows logged since the last loaded sample, without reloading the
+    whole timerange. Only the new rows are fetched and get calculated
+    columns, so the cost of a refresh depends on the number of new rows.
+
+    optional slide : move the start of timerange forward by as much as the
+                     end, dropping rows that fall out of the window.
+    optional WEL_download : in WEL mode, download this month's log first.
+
+    returns the number of new rows.
+    """
+    @profiled('refresh')
+    def refresh(self,
+                slide=False,
+                WEL_download=False):
+        self.now = dt.datetime.now().astimezone(self.to_tzone)
+        last = self.data.index[-1]
+
+        if self.data_source == 'WEL':
+            if WEL_download:
+                self.download_current_log()
+            num_months = ((self.now.year - last.year) * 12
+                          + self.now.month - last.month)
+            monthlist = [last + relativedelta(months=x)
+                         for x in range(num_months + 1)]
+            datalist = []
+            for month in monthlist:
+                filepath = (self.dl_db_path + F'WEL_log_{month.year}'
+                            + F'_{month.month:02d}.xls')
+                if os.path.exists(filepath):
+                    datalist.append(self.read_raw_log(filepath))
+            new = pd.concat(datalist) if datalist else pd.DataFrame()
+            if len(new) > 0:
+                new = new[(new.index > last) & (new.index < self.now)]
+        elif self.data_source == 'Pi':
+            query = {'dateandtime': {'$gt': last.astimezone(self.db_tzone),
+                                     '$lte': self.now
+                                     .astimezone(self.db_tzone)}}
+            new = self.read_mongo(query)
+
+        if slide:
+            self.timerange[0] += self.now - self.timerange[1]
+        self.timerange[1] = self.now
+
+        old_len = len(self.data)
+        if len(new) > 0:
+            # Derived columns already in use are only calculated for the new
+            # rows, from their readings before the shift.
+            names = [col for col in self.data.columns if col in derived_cols]
+            if len(names) > 0:
+                new = pd.concat((new, self.calced_cols(new, names)), axis=1)
+            # Carry the power shift across the boundary: the last old sample
+            # takes the first new reading.
+            for col in [col for col in self.power_cols
+                        if col in new.columns]:
+                self.data.iloc[-1, self.data.columns.get_loc(col)] = \
+                    new[col].iloc[0]
+                new[col] = new[col].shift(-1)
+            self.loaded = pd.concat((self.data, new))
+            self.append_intervals(old_len)
+        if slide:
+            keep = self.data.index > self.timerange[0]
+            dropped = len(keep) - np.count_nonzero(keep)
+            if self.power_head is not None and 0 < dropped < len(keep):
+                # The new first row's reading was shifted onto the last
+                # dropped row.
+                self.power_head = {col: self.data[col].iloc[dropped - 1]
+                                   for col in self.power_head}
+            self.loaded = self.data[keep]
+            self.drop_intervals(dropped)
+        self.data_version += 1
+
+        return len(new)
+
+    """
+    RollupStore for this data, kept in rollup_path.
+    """
+    def rollups(self):
+        path = self.rollup_path
+        if path is None:
+            path = os.path.join(self.dl_db_path, 'rollups')
+        return RollupStore(path)
+
+    """
+    Add the hours and days fully covered by the loaded data to the rollup
+    store. Call after loading or refreshing to keep the store up to date.
+
+    returns number of buckets written per frequency.
+    """
+    def update_rollups(self):
+        self.derive(list(derived_cols))
+        return self.rollups().update(self.data)
+
+    """
+    Hourly or daily aggregates over timerange from the rollup store, without
+    touching the raw data. Mean values over the whole range can be taken as
+    the count weighted mean of <col>__mean.
+
+    optional freq : 'h' or 'D'.
+    optional columns : rollup columns to return, default all.
+    """
+    def summary(self,
+                freq='D',
+                columns=None):
+        return self.rollups().summary(self.timerange[0], self.timerange[1],
+                                      freq=freq, columns=columns)
+
+    """
+    Efficiency statistics over many windows of the loaded data at once,
+    without plotting. Every statistic is a difference of cumulative sums
+    taken at the window edges, so windows may overlap and the cost barely
+    depends on their number. Needs full resolution data.
+
+    optional freq : calendar frequency the timerange is split into, e.g.
+                    'D', 'W' or 'MS'.
+    optional windows : list of [start, end] pairs, end exclusive, used
+                       instead of freq. Naive times are taken in to_tzone.
+                       Default is the whole timerange.
+    optional statusmask : status mask expression, as for plotVar. COP,
+                          energy and runtime only count samples where it
+                          is on.
+
+    returns frame with one row per window:
+    start, end : window edges.
+    hours : hours of data in the window.
+    runtime_h, duty : hours the mask is on, and as a fraction of hours.
+    COP_mean, COP_median, well_COP_mean, well_COP_median : over samples
+        with a valid COP.
+    COP_seasonal : heat_out_kWh over the HP_W energy of the same samples.
+    energy_in_kWh : HP_W + TAH_W electrical energy.
+    HP_kWh : HP_W electrical energy.
+    heat_out_kWh : heat delivered to the air, COP * HP_W.
+    well_kWh : heat drawn from the well, well_W.
+    degree_hours : T_diff integrated over all samples, mask or not.
+    """
+    def efficiencyReport(self,
+                         freq=None,
+                         windows=None,
+                         statusmask=None):
+        index = self.data.index
+        if windows is not None:
+            starts = pd.DatetimeIndex([pd.Timestamp(window[0])
+                                       for window in windows])
+            ends = pd.DatetimeIndex([pd.Timestamp(window[1])
+                                     for window in windows])
+            if starts.tz is None:
+                starts = starts.tz_localize(self.to_tzone)
+                ends = ends.tz_localize(self.to_tzone)
+        elif freq is not None:
+            starts = pd.Series(0, index=index).resample(
+                freq, label='left', closed='left').size().index
+            ends = starts + pd.tseries.frequencies.to_offset(freq)
+        else:
+            starts = pd.DatetimeIndex([self.timerange[0]])
+            ends = pd.DatetimeIndex([self.timerange[1]])
+        lo = index.searchsorted(starts, side='left')
+        hi = index.searchsorted(ends, side='left')
+
+        step = sampleHours(index).to_numpy() if len(index) > 1 \
+            else np.zeros(len(index))
+        if statusmask is None:
+            on = np.ones(len(index), dtype=bool)
+        else:
+            on = np.asarray(self.evalExpr(statusmask, mask=True), dtype=bool)
+
+        def values(expr):
+            return np.asarray(self.evalExpr(expr), dtype=np.float64)
+
+        def window_sum(array):
+            array = np.where(np.isfinite(array), array, 0.)
+            total = np.concatenate(([0.], np.cumsum(array)))
+            return total[hi] - total[lo]
+
+        def window_median(array):
+            if np.all(starts[1:] >= ends[:-1]):
+                # Disjoint windows in order, one grouped pass
+                window = np.cumsum(np.bincount(lo, minlength=len(array)
+                                               + 1))[:len(array)] - 1
+                inside = np.zeros(len(array) + 1, dtype=int)
+                np.add.at(inside, lo, 1)
+                np.add.at(inside, hi, -1)
+                keep = (np.cumsum(inside)[:len(array)] > 0) \
+                    & np.isfinite(array)
+                medians = pd.Series(array[keep]).groupby(window[keep]) \
+                    .median()
+                return medians.reindex(range(len(lo))).to_numpy()
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                return np.array([np.nanmedian(array[a:b]) if b > a
+                                 else np.nan for a, b in zip(lo, hi)])
 
-        # Shift power meter data by one sample for better alignment with others
-        self.data.HP_W = self.data.HP_W.shift(-1)
-        self.data.TAH_W = self.data.TAH_W.shift(-1)
+        report = pd.DataFrame({'start': starts, 'end': ends})
+        report['hours'] = window_sum(step)
+        report['runtime_h'] = window_sum(step * on)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            report['duty'] = report.runtime_h / report.hours
+            for expr in ['COP', 'well_COP']:
+                datum = np.where(on, values(expr), np.nan)
+                report[F'{expr}_mean'] = (window_sum(datum)
+                                          / window_sum(np.isfinite(datum)))
+                report[F'{expr}_median'] = window_median(datum)
+
+            hp = np.where(on, values('HP_W'), np.nan)
+            tah = np.where(on, values('TAH_W'), np.nan)
+            heat = np.where(on, values('COP') * values('HP_W'), np.nan)
+            report['energy_in_kWh'] = window_sum((np.nan_to_num(hp)
+                                                  + np.nan_to_num(tah))
+                                                 * step) / 1000
+            report['HP_kWh'] = window_sum(hp * step) / 1000
+            report['heat_out_kWh'] = window_sum(heat * step) / 1000
+            # Over the same samples as heat_out, idle draw has no COP
+            report['COP_seasonal'] = (report.heat_out_kWh * 1000
+                                      / window_sum(np.where(np.isfinite(heat),
+                                                            hp, np.nan)
+                                                   * step))
+            report['well_kWh'] = window_sum(np.where(on, values('well_W'),
+                                                     np.nan) * step)
+            report['degree_hours'] = window_sum(values('T_diff') * step)
+        return report
 
     """
-    Returns list of all column names.
+    Returns list of all column names, including derived columns that have
+    not been calculated yet.
     """
     def vars(self):
-        return [col for col in self.data.columns]
+        return ([col for col in self.data.columns]
+                + self.derive_order([name for name in derived_cols
+                                     if name not in self.data.columns],
+                                    self.data.columns))
 
     """
     Takes a list with a start and end time. If either is 'none', defaults to
@@ -308,6 +2678,7 @@ class WELData:
     optional mask : indicates this is for status mask data, including a call to
                     remOffset
     """
+    @profiled('varExprParse')
     def varExprParse(self,
                      string,
                      mask=False):
@@ -330,37 +2701,121 @@ class WELData:
 
         return expr
 
+    """
+    Evaluate an expression of column names, e.g. "HP_W / 1000" or
+    "COP.rolling('1D').mean()", into a series. Column names are bound to the
+    data columns, and np and pd are available. Results are kept per
+    (expression, data_version) in an LRU cache, so an expression plotted on
+    several axes is only computed once per load. The result is the cached
+    series itself, so it must not be modified in place.
+
+    string : expression string to evaluate.
+    optional mask : evaluate for status mask data, with every column bound to
+                    its boolean statusOn array, so * is and, + is or.
+    """
+    def evalExpr(self,
+                 string,
+                 mask=False):
+        if self.expr_cache is None:
+            self.expr_cache = OrderedDict()
+        key = (string, mask, self.data_version)
+        if key in self.expr_cache:
+            self.expr_cache.move_to_end(key)
+            return self.expr_cache[key]
+
+        self.derive(compileExpr(string)[1])
+        result = self.evalFrame(self.data, string, mask=mask)
+
+        self.expr_cache[key] = result
+        while len(self.expr_cache) > self.expr_cache_size:
+            self.expr_cache.popitem(last=False)
+        return result
+
+    """
+    Sunrise and sunset times at WELData.loc for a list of dates, from a cache
+    shared by all instances.
+
+    days : list of dates.
+
+    returns lists of sunrise and sunset datetimes in to_tzone.
+    """
+    def sunTimes(self,
+                 days):
+        times = [sunriseSunset(self.loc.latitude, self.loc.longitude,
+                               self.to_tzone, day) for day in days]
+        return [time[0] for time in times], [time[1] for time in times]
+
+    """
+    Evaluate an expression on any frame, as evalExpr does on data but
+    without caching. Derived columns missing from the frame are calculated
+    for the evaluation only.
+
+    frame : frame to evaluate on.
+    string : expression string to evaluate.
+    optional mask : evaluate for status mask data.
+    optional head : first row's power readings when the frame's power
+                    columns are shifted, see logged_power.
+    """
+    @profiled('eval')
+    def evalFrame(self,
+                  frame,
+                  string,
+                  mask=False,
+                  head=None):
+        code, names = compileExpr(string)
+        missing = [name for name in names
+                   if name in derived_cols and name not in frame.columns]
+        if len(missing) > 0:
+            frame = pd.concat((frame, self.calced_cols(frame, missing,
+                                                       head=head)),
+                              axis=1)
+        namespace = {'np': np, 'pd': pd}
+        for name in names:
+            if name in frame.columns:
+                if mask:
+                    namespace[name] = self.statusOn(frame[name])
+                else:
+                    namespace[name] = frame[name]
+        return eval(code, namespace)
+
     """
     Adds day/night background shading based on calculated sunrise/sunset times
-    to the specified axes.
+    to the specified axes. All nights are drawn as a single collection.
 
     axes : axes to plot on.
     timerange : timerange to plot on.
     """
+    @profiled('plotNighttime')
     def plotNighttime(self,
                       axes=None,
                       plot=True):
+        import matplotlib.dates as mdates
+        from matplotlib.collections import PolyCollection
         dayList = [(self.timerange[0] + dt.timedelta(days=x - 1)).date()
                    for x in range((self.timerange[1]
                                    - self.timerange[0]).days + 3)]
-        for day in dayList:
-            day = dt.datetime.combine(day, dt.datetime.min.time())
-            sunrise = sun.sunrise(self.loc.observer, date=day,
-                                  tzinfo=self.to_tzone)
-            sunset = sun.sunset(self.loc.observer, date=day,
-                                tzinfo=self.to_tzone)
-            # print(F"#DEBUG: sunrise: {sunrise}, sunset: {sunset}")
-            timelist = [day, sunrise - dt.timedelta(seconds=1), sunrise,
-                        sunset, sunset + dt.timedelta(seconds=1),
-                        day + dt.timedelta(days=1)]
-
-            if plot:
-                axes.autoscale(enable=False)
-                limits = axes.get_ylim()
-                axes.fill_between(timelist, np.full(len(timelist), limits[0]),
-                                  np.full(len(timelist), limits[1]),
-                                  where=[True, True, False, False, True, True],
-                                  facecolor='black', alpha=0.05)
+        sunrises, sunsets = self.sunTimes(dayList)
+        midnights = [dt.datetime.combine(day, dt.time.min,
+                                         tzinfo=self.to_tzone)
+                     for day in dayList + [dayList[-1]
+                                           + dt.timedelta(days=1)]]
+        timelist = [midnights[-2], sunrises[-1] - dt.timedelta(seconds=1),
+                    sunrises[-1], sunsets[-1],
+                    sunsets[-1] + dt.timedelta(seconds=1), midnights[-1]]
+
+        if plot:
+            # Nights run from each sunset to the next sunrise, plus the
+            # mornings and evening at either end.
+            starts = mdates.date2num([midnights[0]] + sunsets)
+            ends = mdates.date2num(sunrises + [midnights[-1]])
+            verts = np.zeros((len(starts), 4, 2))
+            verts[:, :, 0] = np.column_stack((starts, starts, ends, ends))
+            verts[:, :, 1] = [0, 1, 1, 0]
+            axes.autoscale(enable=False)
+            nights = PolyCollection(verts, facecolor='black', alpha=0.05,
+                                    edgecolor='none',
+                                    transform=axes.get_xaxis_transform())
+            axes.add_collection(nights, autolim=False)
         return timelist
 
     """
@@ -369,10 +2824,49 @@ class WELData:
     """
     def remOffset(self,
                   status):
-        mask = np.array(status) % 2
+        mask = np.array(status, dtype=np.float64) % 2
         mask[mask == 0.] = np.nan
         return mask
 
+    """
+    Boolean on/off array of a status channel, False where it is off or
+    missing.
+
+    status : status channel data.
+    """
+    def statusOn(self,
+                 status):
+        return np.asarray(status) == 1
+
+    """
+    Evaluate plot expressions and apply a status mask to them, as plotted by
+    plotVar.
+
+    y : list of expression strings.
+    optional statusmask : status mask expression.
+
+    returns lists of the unmasked and masked series.
+    """
+    def plotData(self,
+                 y,
+                 statusmask=None):
+        if statusmask in (self.intervals or {}):
+            # Single channel masks come straight from the on-run index
+            def applyMask(datum):
+                return self.maskIntervals(datum, statusmask)
+        elif statusmask is not None:
+            smask = np.asarray(self.evalExpr(statusmask, mask=True),
+                               dtype=bool)
+
+            def applyMask(datum):
+                return datum.where(smask)
+        else:
+            def applyMask(datum):
+                return datum
+
+        ploty = [self.evalExpr(expr) for expr in y]
+        return ploty, [applyMask(plotDatum) for plotDatum in ploty]
+
     """
     Plot two variables against each other.
 
@@ -392,6 +2886,7 @@ class WELData:
 
     returns plotted data as dictionary of dataframes
     """
+    @profiled('plotVar')
     def plotVar(self,
                 y,
                 x='dateandtime',
@@ -402,25 +2897,20 @@ class WELData:
                 axes=None,
                 nighttime=True,
                 **kwargs):
+        import matplotlib.pyplot as plt
         if type(y) is not list:
             y = [y]
-        p_locals = locals()
-        if statusmask is not None:
-            smask = eval(self.varExprParse(statusmask, mask=True), p_locals)
-        else:
-            smask = np.full(np.shape(self.data.index), True)
-
-        # plotx = eval(self.varExprParse(x), p_locals)
-        ploty = [eval(self.varExprParse(expr), p_locals) for expr in y]
+        # plotx = self.evalExpr(x)
+        ploty, masked = self.plotData(y, statusmask)
 
         if axes is None:
             fig = plt.figure(figsize=self.figsize)
             axes = plt.gca()
 
         if ('time' or 'date') in x:
-            lines = {label: axes.plot_date(plotDatum.index, plotDatum * smask,
+            lines = {label: axes.plot_date(maskDatum.index, maskDatum,
                                            '-', label=label, **kwargs)
-                     for label, plotDatum in zip(y, ploty)}
+                     for label, maskDatum in zip(y, masked)}
             if statusmask is not None and maskghost:
                 [axes.plot_date(plotDatum.index, plotDatum, fmt='-', alpha=0.3,
                                 color=lines[label][0].get_color(), **kwargs)
@@ -454,7 +2944,25 @@ class WELData:
         axes.grid(True)
         plt.tight_layout()
 
-        return {label: datum * smask for label, datum in zip(y, ploty)}
+        if statusmask in (self.intervals or {}):
+            # maskIntervals only keeps the on rows, which is fine to draw but
+            # the returned series stay aligned with data
+            smask = np.asarray(self.evalExpr(statusmask, mask=True),
+                               dtype=bool)
+            masked = [datum.where(smask) for datum in ploty]
+        elif statusmask is None:
+            # Unmasked data is evalExpr's cached series, hand out copies
+            masked = [datum.copy() for datum in ploty]
+        return {label: datum for label, datum in zip(y, masked)}
+
+    """
+    Start a live updating plot of expressions, see LivePlot. Call update()
+    on the result to pull in and draw new samples.
+    """
+    def livePlot(self,
+                 y,
+                 **kwargs):
+        return LivePlot(self, y, **kwargs)
 
     """
     Plots all hardcoded status variables against time.
@@ -465,6 +2973,7 @@ class WELData:
     optional axes : axes to draw plot on instead of default figure.
     optional nighttime : adds day/night shading to plot.
     """
+    @profiled('plotStatus')
     def plotStatus(self,
                    axes=None,
                    nighttime=True,
@@ -476,26 +2985,27 @@ class WELData:
                                 'zone_1_b',
                                 'zone_2_b',
                                 'humid_b']):
+        import matplotlib.pyplot as plt
         labels = [stat[:-2] for stat in status_list]
 
-        p_locals = locals()
-        # plotx = eval(self.varExprParse('dateandtime'), p_locals)
-        ploty = [eval(self.varExprParse(stat), p_locals)
-                 for stat in status_list]
+        # plotx = self.evalExpr('dateandtime')
+        ploty = [self.evalExpr(stat) for stat in status_list]
 
         if axes is None:
             fig = plt.figure(figsize=(self.figsize[0], self.figsize[1] * 0.75))
             axes = plt.gca()
 
-        [axes.plot_date(plotDatum.index, plotDatum, fmt='-', label=label)
-            for label, plotDatum in zip(labels, ploty)]
+        # Offset each channel by its position so they stack
+        [axes.plot_date(plotDatum.index, 2 * pos + plotDatum.astype(float),
+                        fmt='-', label=label)
+            for pos, (label, plotDatum) in enumerate(zip(labels, ploty))]
 
         axes.set_ylim((-0.75, 2 * (len(status_list) - 1) + 1.75))
         if nighttime:
             self.plotNighttime(axes=axes)
 
         plt.setp(axes.get_xticklabels(), rotation=20, ha='right')
-        axes.set_yticks(np.arange(0, 16, 2))
+        axes.set_yticks(np.arange(0, 2 * len(status_list), 2))
         axes.set_yticklabels(labels)
         axes.yaxis.set_label_position("right")
         axes.yaxis.tick_right()
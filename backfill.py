@@ -0,0 +1,38 @@
+import WELServer
+import datetime as dt
+import argparse
+import time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', type=str, action='store', default='./log_db/',
+                        help='folder holding the WEL monthly logs.')
+    parser.add_argument('-a', type=str, action='store', default=None,
+                        help='mongo address.')
+    parser.add_argument('-c', type=str, action='store', default='data',
+                        help='collection to import into.')
+    parser.add_argument('-b', type=int, action='store', default=5000,
+                        help='rows per bulk write.')
+    parser.add_argument('-t', action='store_true',
+                        help='create the collection as a time series '
+                             'collection.')
+    parser.add_argument('-s', action='store_true',
+                        help='download missing months into the folder first.')
+    parser.add_argument('-f', action='store_true',
+                        help='reimport every month, even if already imported.')
+    args = parser.parse_args()
+
+    if args.a is not None:
+        WELServer.mongoConfigure(address=args.a)
+    if args.s:
+        WELServer.LogSync(args.d).sync(dt.datetime.now())
+
+    backfill = WELServer.MongoBackfill(args.d, WELServer.mongoConnect(),
+                                       collection=args.c, batch=args.b,
+                                       timeseries=args.t)
+    start = time.time()
+    rows = backfill.run(force=args.f)
+    seconds = time.time() - start
+    print(F'imported {rows} rows in {seconds:.1f} s, '
+          F'{rows / max(seconds, 1e-9):.0f} rows/s')
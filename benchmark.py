@@ -0,0 +1,488 @@
+import matplotlib
+matplotlib.use('Agg')
+import WELServer
+import render_service
+import matplotlib.pyplot as plt
+import pandas as pd
+import numpy as np
+import datetime as dt
+import argparse
+import tempfile
+import timeit
+import tracemalloc
+import subprocess
+import json
+import sys
+import os
+
+
+status_list = ['aux_heat_b',
+               'heat_1_b',
+               'heat_2_b',
+               'rev_valve_b',
+               'TAH_fan_b',
+               'zone_1_b',
+               'zone_2_b',
+               'humid_b']
+
+temp_list = ['living_T',
+             'trist_T',
+             'base_T',
+             'outside_T',
+             'TAH_in_T',
+             'TAH_out_T',
+             'loop_in_T',
+             'loop_out_T',
+             'liqu_refrig_T',
+             'gas_refrig_T',
+             'wood_fire_T']
+
+
+"""
+Build a synthetic WEL monthly log with the same columns and string formats as
+the real thing. One sample per minute, with '?' in place of missing values.
+
+year, month : month the log covers.
+nan_frac : fraction of analog samples replaced with '?'.
+seed : random seed.
+
+returns the log as a DataFrame of strings, ready to be written out.
+"""
+def synth_month(year,
+                month,
+                nan_frac=0.01,
+                seed=0):
+    rng = np.random.default_rng(seed + year * 12 + month)
+    start = dt.datetime(year, month, 1)
+    end = (start + dt.timedelta(days=32)).replace(day=1)
+    stamps = pd.date_range(start, end, freq='1min', inclusive='left')
+    n = len(stamps)
+
+    frame = pd.DataFrame()
+    frame['Date'] = stamps.strftime("%m/%d/%Y")
+    frame['Time'] = stamps.strftime("%H:%M:%S")
+
+    daily = np.sin(2 * np.pi * (stamps.hour * 60 + stamps.minute) / 1440)
+    for i, col in enumerate(temp_list):
+        frame[col] = (15 + 5 * daily + i
+                      + rng.normal(0, 0.2, n)).round(1)
+    running = (rng.random(n // 30 + 1) > 0.5).repeat(30)[:n]
+    frame['TAH_fpm'] = np.where(running, 3 + rng.normal(0, 0.1, n), 0.)
+    frame['HP_W'] = np.where(running, 2500 + rng.normal(0, 50, n),
+                             5.).round(0)
+    frame['TAH_W'] = np.where(running, 400 + rng.normal(0, 10, n),
+                              2.).round(0)
+    frame['TAH_in_T'] = frame.TAH_in_T.where(~running, 19.)
+    frame['TAH_out_T'] = frame.TAH_out_T.where(~running, 35.)
+    for i, col in enumerate(status_list):
+        on = running if col in ('heat_1_b', 'TAH_fan_b') else \
+            (rng.random(n // 60 + 1) > 0.8).repeat(60)[:n]
+        frame[col] = 2. * i + on
+
+    analog = [col for col in frame.columns
+              if col not in ['Date', 'Time'] + status_list]
+    frame[analog] = frame[analog].astype(object)
+    for col in analog:
+        frame.loc[rng.random(n) < nan_frac, col] = '?'
+
+    return frame
+
+
+"""
+Write synthetic monthly logs into a db folder using the WEL file naming.
+
+returns list of written filepaths.
+"""
+def write_months(db_path,
+                 monthlist):
+    paths = []
+    for month in monthlist:
+        filepath = os.path.join(db_path, F'WEL_log_{month.year}'
+                                         F'_{month.month:02d}.xls')
+        synth_month(month.year, month.month).to_csv(filepath, sep='\t',
+                                                    index=False)
+        paths.append(filepath)
+    return paths
+
+
+"""
+Build a mongomock database with a Pi style data collection holding the
+synthetic logs for the given months, timestamps stored as naive UTC.
+"""
+def synth_pi_db(monthlist,
+                index=True):
+    import mongomock
+    mongo_db = mongomock.MongoClient().WEL
+    for month in monthlist:
+        frame = synth_month(month.year, month.month).replace('?', np.nan)
+        stamps = (pd.to_datetime(frame.Date + ' ' + frame.Time)
+                  + pd.Timedelta(hours=5))
+        frame = frame.drop(columns=['Date', 'Time']).astype(np.float64)
+        frame['dateandtime'] = list(stamps.dt.to_pydatetime())
+        mongo_db.data.insert_many(frame.to_dict('records'))
+    if index:
+        WELServer.ensure_mongo_index(mongo_db)
+    return mongo_db
+
+
+"""
+WELData in Pi mode on a given mongo database, without loading any data or
+sharing the segment cache.
+"""
+def bare_pi_data(mongo_db,
+                 timerange,
+                 columns=None):
+    dat = WELServer.WELData.__new__(WELServer.WELData)
+    dat.data_source = 'Pi'
+    dat.mongo_db = mongo_db
+    dat.columns = columns
+    dat.segment_cache = None
+    dat.timerange = [time.replace(tzinfo=dat.to_tzone) for time in timerange]
+    return dat
+
+
+"""
+Run func once, returning (seconds, peak traced memory in bytes).
+"""
+def time_and_peak(func):
+    tracemalloc.start()
+    start = timeit.default_timer()
+    func()
+    elapsed = timeit.default_timer() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+"""
+Timestamp parsing as done before the vectorized path, kept as a reference.
+"""
+def legacy_parse_datetime(data):
+    date = data.Date.apply(lambda date:
+                           dt.datetime.strptime(date, "%m/%d/%Y"))
+    time = data.Time.apply(lambda time:
+                           dt.datetime.strptime(time, "%H:%M:%S").time())
+    index = pd.DatetimeIndex([dt.datetime.combine(d, t)
+                              for d, t in zip(date, time)])
+    return index.tz_localize(WELServer.tz.gettz('EST'))
+
+
+def bench_parse_datetime(dat, repeat, results):
+    frame = synth_month(2021, 1)
+    legacy = legacy_parse_datetime(frame)
+    vector = pd.DatetimeIndex(dat.parse_datetime(frame.Date, frame.Time)) \
+        .tz_localize(WELServer.tz.gettz('EST'))
+    assert legacy.tz_convert(dat.to_tzone) \
+        .equals(vector.tz_convert(dat.to_tzone))
+
+    t_legacy = min(timeit.repeat(lambda: legacy_parse_datetime(frame),
+                                 number=1, repeat=repeat))
+    t_vector = min(timeit.repeat(lambda: dat.parse_datetime(frame.Date,
+                                                            frame.Time),
+                                 number=1, repeat=repeat))
+    results['parse_datetime/legacy'] = t_legacy
+    results['parse_datetime/vectorized'] = t_vector
+    print(F'parse_datetime ({len(frame)} rows): '
+          F'legacy {t_legacy * 1000:.1f} ms, '
+          F'vectorized {t_vector * 1000:.1f} ms, '
+          F'speedup {t_legacy / t_vector:.1f}x')
+
+
+def bench_read_log(dat, repeat, results):
+    with tempfile.TemporaryDirectory() as db_path:
+        filepath = write_months(db_path, [dt.date(2021, 1, 1)])[0]
+        dat.cache_logs = False
+        t_read = min(timeit.repeat(lambda: dat.read_log(filepath),
+                                   number=1, repeat=repeat))
+        dat.cache_logs = True
+        dat.read_log(filepath)
+        t_cached = min(timeit.repeat(lambda: dat.read_log(filepath),
+                                     number=1, repeat=repeat))
+        del dat.cache_logs
+    results['read_log/parse'] = t_read
+    results['read_log/cached'] = t_cached
+    print(F'read_log (1 month): parse {t_read * 1000:.1f} ms, '
+          F'cached {t_cached * 1000:.1f} ms')
+
+
+"""
+WELData in WEL mode over a synthetic db, without the download db refresh or
+the segment cache.
+"""
+def bare_wel_data(db_path,
+                  timerange,
+                  load_workers=1):
+    dat = WELServer.WELData.__new__(WELServer.WELData)
+    dat.data_source = 'WEL'
+    dat.dl_db_path = os.path.join(db_path, '')
+    dat.load_workers = load_workers
+    dat.segment_cache = None
+    dat.timerange = [time.replace(tzinfo=dat.to_tzone) for time in timerange]
+    return dat
+
+
+def bench_stitch(repeat, workers, results, month_counts=(1, 6, 12)):
+    monthlist = [dt.date(2021 + x // 12, x % 12 + 1, 1)
+                 for x in range(max(month_counts))]
+    with tempfile.TemporaryDirectory() as db_path:
+        write_months(db_path, monthlist)
+        for count in month_counts:
+            last = monthlist[count - 1]
+            timerange = [dt.datetime(2021, 1, 1),
+                         dt.datetime(last.year, last.month, 28)]
+            timings = []
+            for load_workers in (1, workers):
+                def load():
+                    dat = bare_wel_data(db_path, timerange, load_workers)
+                    dat.cache_logs = False
+                    dat.stitch()
+                timings.append(min(timeit.repeat(load, number=1,
+                                                 repeat=repeat)))
+            results[F'stitch/{count}m/serial'] = timings[0]
+            results[F'stitch/{count}m/workers'] = timings[1]
+            print(F'stitch ({count} months): serial {timings[0]:.2f} s, '
+                  F'{workers} workers {timings[1]:.2f} s, '
+                  F'speedup {timings[0] / timings[1]:.1f}x')
+
+
+def bench_read_mongo(repeat, results):
+    mongo_db = synth_pi_db([dt.date(2021, 1, 1)])
+    query = {'dateandtime': {'$gte': dt.datetime(2021, 1, 1, 5),
+                             '$lte': dt.datetime(2021, 1, 8, 5)}}
+
+    def legacy():
+        frame = pd.DataFrame(list(mongo_db.data.find(query)))
+        frame.index = frame['dateandtime']
+        return frame.drop(columns=['dateandtime'])
+
+    dat = bare_pi_data(mongo_db, [dt.datetime(2021, 1, 1),
+                                  dt.datetime(2021, 1, 8)])
+    proj = bare_pi_data(mongo_db, [dt.datetime(2021, 1, 1),
+                                   dt.datetime(2021, 1, 8)],
+                        columns=['COP', 'heat_1_b'])
+    cases = [('legacy', legacy),
+             ('all columns', lambda: dat.read_mongo(query)),
+             ('COP, heat_1_b', lambda: proj.read_mongo(query))]
+    for label, func in cases:
+        timings = [time_and_peak(func) for x in range(repeat)]
+        results[F'read_mongo/{label}'] = min(t for t, p in timings)
+        print(F'read_mongo {label} (1 week): '
+              F'{min(t for t, p in timings):.2f} s, '
+              F'peak {max(p for t, p in timings) / 2**20:.0f} MiB')
+
+
+"""
+WELData in WEL mode loaded from a synthetic month, days long from the start
+of the month.
+"""
+def loaded_wel_data(db_path,
+                    days):
+    write_months(db_path, [dt.date(2021, 1, 1)])
+    dat = bare_wel_data(db_path, [dt.datetime(2021, 1, 1),
+                                  dt.datetime(2021, 1, 1)
+                                  + dt.timedelta(days=days)])
+    dat.stitch()
+    return dat
+
+
+def bench_calced_cols(repeat, results):
+    with tempfile.TemporaryDirectory() as db_path:
+        dat = loaded_wel_data(db_path, 28)
+        t_calced = min(timeit.repeat(lambda: dat.calced_cols(dat.data),
+                                     number=1, repeat=repeat))
+    results['calced_cols/1m'] = t_calced
+    print(F'calced_cols (1 month): {t_calced * 1000:.1f} ms')
+
+
+"""
+Expression evaluation through varExprParse and eval on self.data, as the
+plotting used to, against evalFrame. Neither goes through the evalExpr cache.
+"""
+def bench_eval(repeat, results):
+    exprs = ['living_T', 'HP_W / 1000', "COP.rolling('1D').mean()"]
+    with tempfile.TemporaryDirectory() as db_path:
+        dat = loaded_wel_data(db_path, 28)
+        dat.derive(list(WELServer.derived_cols))
+
+        def legacy():
+            [eval(dat.varExprParse(expr), {'self': dat})
+             for expr in exprs]
+        t_legacy = min(timeit.repeat(legacy, number=1, repeat=repeat))
+        t_frame = min(timeit.repeat(lambda: [dat.evalFrame(dat.data, expr)
+                                             for expr in exprs],
+                                    number=1, repeat=repeat))
+    results['eval/varExprParse'] = t_legacy
+    results['eval/evalFrame'] = t_frame
+    print(F'eval ({len(exprs)} expressions, 1 month): '
+          F'varExprParse {t_legacy * 1000:.1f} ms, '
+          F'evalFrame {t_frame * 1000:.1f} ms')
+
+
+def bench_plot_nighttime(repeat, results):
+    for days in (7, 28):
+        dat = bare_wel_data('', [dt.datetime(2021, 1, 1),
+                                 dt.datetime(2021, 1, 1)
+                                 + dt.timedelta(days=days)])
+        fig, axes = plt.subplots()
+
+        def plot():
+            dat.plotNighttime(axes=axes)
+            fig.canvas.draw()
+            [collection.remove() for collection in axes.collections]
+        t_night = min(timeit.repeat(plot, number=1, repeat=repeat))
+        plt.close(fig)
+        results[F'plotNighttime/{days}d'] = t_night
+        print(F'plotNighttime ({days} days, drawn): '
+              F'{t_night * 1000:.1f} ms')
+
+
+"""
+Full monitor.py and efficiency.py style figures, built and rendered to png,
+over a week of synthetic data.
+"""
+def bench_figures(repeat, results):
+    with tempfile.TemporaryDirectory() as db_path:
+        dat = loaded_wel_data(db_path, 7)
+        for name, layout in render_service.DASHBOARDS.items():
+            def build():
+                dashboard = render_service.Dashboard(dat, layout)
+                dashboard.render('png')
+                plt.close(dashboard.fig)
+            t_build = min(timeit.repeat(build, number=1, repeat=repeat))
+            results[F'figure/{name}'] = t_build
+            print(F'figure {name} (1 week, build and render): '
+                  F'{t_build:.2f} s')
+
+
+"""
+efficiencyReport over a year of synthetic data, by day and by week.
+"""
+def bench_report(repeat, results):
+    monthlist = [dt.date(2021, x + 1, 1) for x in range(12)]
+    with tempfile.TemporaryDirectory() as db_path:
+        write_months(db_path, monthlist)
+        dat = bare_wel_data(db_path, [dt.datetime(2021, 1, 1),
+                                      dt.datetime(2021, 12, 31)])
+        dat.stitch()
+        dat.derive(list(WELServer.derived_cols))
+        for freq in ('D', 'W'):
+            def report():
+                dat.expr_cache = None
+                dat.efficiencyReport(freq=freq, statusmask='heat_1_b')
+            t_report = min(timeit.repeat(report, number=1, repeat=repeat))
+            results[F'efficiencyReport/12m/{freq}'] = t_report
+            print(F'efficiencyReport (12 months, freq {freq}, '
+                  F'{len(dat.data)} rows): {t_report * 1000:.0f} ms')
+
+
+"""
+Time a fresh interpreter importing WELServer and check that the plotting,
+download and mongo modules stay unloaded until used.
+
+budget : seconds the import may take.
+
+returns True if the import is within budget and stayed lazy.
+"""
+def bench_import(repeat, results, budget=1.0):
+    script = ('import sys, time\n'
+              't = time.perf_counter()\n'
+              'import WELServer\n'
+              'print(time.perf_counter() - t)\n'
+              'print(",".join(m for m in ("matplotlib.pyplot", "pymongo", '
+              '"asyncio", "wget") if m in sys.modules))\n')
+    timings = []
+    for x in range(repeat):
+        out = subprocess.run([sys.executable, '-c', script],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        seconds, loaded = out.stdout.split('\n')[:2]
+        timings.append(float(seconds))
+    t_import = min(timings)
+    results['import/WELServer'] = t_import
+    print(F'import WELServer: {t_import * 1000:.0f} ms '
+          F'(budget {budget * 1000:.0f} ms)'
+          + (F', eagerly loaded {loaded}' if loaded else ''))
+    return t_import <= budget and not loaded
+
+
+"""
+Print each result against a stored baseline, flagging any that got slower
+by more than tolerance.
+
+returns list of regressed benchmark names.
+"""
+def compare_baseline(results,
+                     baseline,
+                     tolerance=0.2):
+    regressed = []
+    print(F'{"benchmark":<32}{"baseline":>12}{"now":>12}{"ratio":>8}')
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        ratio = seconds / baseline[name]
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  slower'
+            regressed.append(name)
+        print(F'{name:<32}{baseline[name] * 1000:>10.1f}ms'
+              F'{seconds * 1000:>10.1f}ms{ratio:>8.2f}{flag}')
+    return regressed
+
+
+benchmarks = ['import', 'parse_datetime', 'read_log', 'stitch', 'read_mongo',
+              'calced_cols', 'eval', 'plotNighttime', 'figure', 'report']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, action='store', default=5,
+                        help='number of repeats for each timing.')
+    parser.add_argument('-w', type=int, action='store',
+                        default=os.cpu_count(),
+                        help='number of worker processes for stitch.')
+    parser.add_argument('-k', type=str, action='store', nargs='+',
+                        default=benchmarks, choices=benchmarks,
+                        help='benchmarks to run.')
+    parser.add_argument('-s', type=str, action='store', default=None,
+                        help='save the timings as a baseline json file.')
+    parser.add_argument('-c', type=str, action='store', default=None,
+                        help='compare the timings to a baseline json file.')
+    parser.add_argument('--tolerance', type=float, action='store',
+                        default=0.2, help='slowdown allowed against the '
+                                          'baseline before flagging.')
+    parser.add_argument('--import-budget', type=float, action='store',
+                        default=1.0, help='seconds importing WELServer may '
+                                          'take.')
+    args = parser.parse_args()
+
+    # Bare object, no data load or download
+    dat = WELServer.WELData.__new__(WELServer.WELData)
+
+    results = {}
+    failed = []
+
+    def check_import():
+        if not bench_import(args.n, results, args.import_budget):
+            failed.append('import')
+    runs = {'import': check_import,
+            'parse_datetime': lambda: bench_parse_datetime(dat, args.n,
+                                                           results),
+            'read_log': lambda: bench_read_log(dat, args.n, results),
+            'stitch': lambda: bench_stitch(args.n, args.w, results),
+            'read_mongo': lambda: bench_read_mongo(args.n, results),
+            'calced_cols': lambda: bench_calced_cols(args.n, results),
+            'eval': lambda: bench_eval(args.n, results),
+            'plotNighttime': lambda: bench_plot_nighttime(args.n, results),
+            'figure': lambda: bench_figures(args.n, results),
+            'report': lambda: bench_report(args.n, results)}
+    [runs[name]() for name in benchmarks if name in args.k]
+
+    if args.s is not None:
+        with open(args.s, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.c is not None:
+        with open(args.c) as f:
+            baseline = json.load(f)
+        failed += compare_baseline(results, baseline, args.tolerance)
+    if len(failed) > 0:
+        sys.exit(1)
@@ -0,0 +1,289 @@
+import matplotlib
+matplotlib.use('Agg')
+import WELServer
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from matplotlib.collections import PolyCollection
+import numpy as np
+import datetime as dt
+import argparse
+import threading
+import time
+import io
+import os
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+"""
+Dashboard layouts, following monitor.py and efficiency.py. Each panel is
+(axes number, plotVar keyword arguments), or (axes number, 'status') for a
+plotStatus panel. 'legend': False removes the panel's legend.
+"""
+DASHBOARDS = {
+    'monitor': {
+        'figsize': (9, 9.5),
+        'height_ratios': [0.3, 0.4, 0.6, 0.2],
+        'panels': [(0, 'status'),
+                   (1, {'y': ['living_T', 'trist_T', 'base_T'],
+                        'statusmask': 'heat_1_b'}),
+                   (2, {'y': ['TAH_in_T', 'TAH_out_T', 'loop_in_T',
+                              'loop_out_T', 'liqu_refrig_T',
+                              'gas_refrig_T'],
+                        'statusmask': 'heat_1_b'}),
+                   (2, {'y': ['outside_T'], 'nighttime': False,
+                        'lw': 2.5}),
+                   (3, {'y': ['COP.rolling({rolling}).mean()'],
+                        'yunits': 'COP {rolling} Mean',
+                        'legend': False})],
+    },
+    'efficiency': {
+        'figsize': (12, 10),
+        'height_ratios': [1, 0.7, 0.7, 0.7, 0.7],
+        'panels': [(0, {'y': ['TAH_in_T', 'TAH_out_T', 'loop_in_T',
+                              'loop_out_T', 'outside_T'],
+                        'statusmask': 'heat_1_b'}),
+                   (1, 'status'),
+                   (2, {'y': ['HP_W / 1000', 'well_W'], 'yunits': 'kW',
+                        'statusmask': 'heat_1_b'}),
+                   (3, {'y': ['TAH_fpm'], 'yunits': 'Wind Speed [m/s]'}),
+                   (4, {'y': ['COP', 'well_COP',
+                              "COP.rolling('1D').mean()"],
+                        'yunits': 'COP', 'statusmask': 'heat_1_b'})],
+    },
+}
+
+
+class Dashboard:
+    """
+    A dashboard figure built once from a warm WELData. Updates refresh the
+    data incrementally and move the existing lines with set_data instead of
+    replotting, then only the night shading is redrawn.
+
+    dat : loaded WELData.
+    layout : one of DASHBOARDS.
+    """
+    def __init__(self,
+                 dat,
+                 layout):
+        self.dat = dat
+        self.layout = layout
+        self.lock = threading.Lock()
+        self.rendered = {}
+        self.build()
+
+    def build(self):
+        hours = ((self.dat.timerange[1] - self.dat.timerange[0])
+                 .total_seconds() / 3600)
+        rolling = F"'{int(np.clip(round(hours / 4), 1, 24))}h'"
+
+        self.fig, self.axes = plt.subplots(
+            len(self.layout['height_ratios']), 1, sharex=True,
+            figsize=self.layout['figsize'],
+            gridspec_kw={'height_ratios': self.layout['height_ratios']})
+        # (axes, 'status' or (expressions, statusmask), lines) per panel
+        self.panels = []
+        for num, spec in self.layout['panels']:
+            axes = self.axes[num]
+            before = len(axes.get_lines())
+            if spec == 'status':
+                self.dat.plotStatus(axes=axes)
+                lines = axes.get_lines()[before:]
+                self.panels.append((axes, spec, lines))
+                continue
+            kwargs = dict(spec)
+            legend = kwargs.pop('legend', True)
+            kwargs['y'] = [y.format(rolling=rolling) for y in kwargs['y']]
+            if 'yunits' in kwargs:
+                kwargs['yunits'] = kwargs['yunits'].format(
+                    rolling=rolling.strip("'"))
+            self.dat.plotVar(axes=axes, **kwargs)
+            if not legend:
+                axes.get_legend().remove()
+            lines = axes.get_lines()[before:]
+            self.panels.append((axes, (kwargs['y'],
+                                       kwargs.get('statusmask')), lines))
+        plt.subplots_adjust(hspace=0.02)
+        self.updated = time.time()
+
+    """
+    Pull new rows into the warm WELData and move the existing artists. In
+    WEL mode this month's log is downloaded again first if the WELData was
+    made with WEL_download.
+
+    returns number of new rows.
+    """
+    def update(self):
+        with self.lock:
+            new_rows = self.dat.refresh(slide=True,
+                                        WEL_download=self.dat.WEL_download)
+            for axes, spec, lines in self.panels:
+                if spec == 'status':
+                    status = [line.get_label() + '_b' for line in lines]
+                    ploty = [self.dat.evalExpr(stat) for stat in status]
+                    shown = [2 * pos + datum.astype(float)
+                             for pos, datum in enumerate(ploty)]
+                else:
+                    y, statusmask = spec
+                    ploty, masked = self.dat.plotData(y, statusmask)
+                    # Masked lines first, then their ghosts if any
+                    shown = (masked + ploty)[:len(lines)]
+                for line, datum in zip(lines, shown):
+                    line.set_data(mdates.date2num(datum.index),
+                                  np.asarray(datum, dtype=np.float64))
+                if spec != 'status':
+                    axes.relim(visible_only=True)
+                    axes.autoscale(enable=True, axis='y')
+                    axes.autoscale_view(scalex=False)
+                axes.set_xlim(self.dat.timerange)
+            for axes in self.axes:
+                [collection.remove() for collection in axes.collections
+                 if isinstance(collection, PolyCollection)]
+                self.dat.plotNighttime(axes=axes)
+            self.rendered = {}
+            self.updated = time.time()
+            return new_rows
+
+    """
+    Render the figure, reusing the last render until the next update.
+
+    fmt : 'png' or 'svg'.
+
+    returns image bytes.
+    """
+    def render(self,
+               fmt='png'):
+        with self.lock:
+            if fmt not in self.rendered:
+                buffer = io.BytesIO()
+                with self.dat.timer('render'):
+                    self.fig.savefig(buffer, format=fmt)
+                self.rendered[fmt] = buffer.getvalue()
+            return self.rendered[fmt]
+
+    def write(self,
+              out_dir,
+              name,
+              formats=('png',)):
+        for fmt in formats:
+            filepath = os.path.join(out_dir, F'{name}.{fmt}')
+            with open(filepath + '.tmp', 'wb') as f:
+                f.write(self.render(fmt))
+            os.replace(filepath + '.tmp', filepath)
+
+
+"""
+HTTP handler serving /<dashboard>.png and /<dashboard>.svg. Images older
+than the update interval are refreshed before they are served. When the
+dashboards are profiled, /<dashboard>.json and /<dashboard>.prom serve their
+load and plot stats.
+"""
+class RenderHandler(BaseHTTPRequestHandler):
+    dashboards = {}
+    interval = 60
+
+    def do_GET(self):
+        name, _, fmt = self.path.strip('/').partition('.')
+        if name not in self.dashboards:
+            self.send_error(404)
+            return
+        dashboard = self.dashboards[name]
+        if fmt in ('json', 'prom'):
+            self.send_stats(dashboard.dat.stats, fmt)
+            return
+        if fmt not in ('png', 'svg'):
+            self.send_error(404)
+            return
+        if time.time() - dashboard.updated > self.interval:
+            dashboard.update()
+        body = dashboard.render(fmt)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png' if fmt == 'png'
+                         else 'image/svg+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stats(self,
+                   stats,
+                   fmt):
+        if stats is None:
+            self.send_error(404)
+            return
+        if fmt == 'json':
+            body = stats.to_json().encode()
+            content_type = 'application/json'
+        else:
+            body = stats.to_prometheus().encode()
+            content_type = 'text/plain; version=0.0.4'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', type=str, action='store', nargs='+',
+                        default=['monitor'], choices=list(DASHBOARDS),
+                        help='dashboards to serve.')
+    parser.add_argument('-s', type=str, action='store', default='Pi',
+                        choices=['Pi', 'WEL'], help='data source.')
+    parser.add_argument('-t', type=int, action='store', default=12,
+                        help='number of hours into past to plot.')
+    parser.add_argument('-i', type=int, action='store', default=60,
+                        help='seconds between updates.')
+    parser.add_argument('-o', type=str, action='store', default=None,
+                        help='folder to write images to after each update.')
+    parser.add_argument('-f', type=str, action='store', nargs='+',
+                        default=['png'], help='image formats to write.')
+    parser.add_argument('-p', type=int, action='store', default=None,
+                        help='serve images over http on this port.')
+    parser.add_argument('-m', action='store_true',
+                        help='profile load and plot stages, served as '
+                             '/<dashboard>.json and /<dashboard>.prom and '
+                             'written next to the images.')
+    parser.add_argument('-a', type=str, action='store', default=None,
+                        help='mongo address, shared by all dashboards.')
+    args = parser.parse_args()
+
+    if args.a is not None:
+        WELServer.mongoConfigure(address=args.a)
+    now = dt.datetime.now()
+    # The first dashboard downloads this month's WEL log on every update,
+    # the others read the same folder after it
+    dat = WELServer.WELData(data_source=args.s,
+                            timerange=[now - dt.timedelta(hours=args.t),
+                                       'none'],
+                            WEL_download=args.s == 'WEL',
+                            profile=args.m)
+    # One warm WELData per dashboard, since updates slide the window
+    dashboards = {name: Dashboard(dat if num == 0 else
+                                  WELServer.WELData(
+                                      data_source=args.s,
+                                      timerange=[now - dt.timedelta(
+                                          hours=args.t), 'none'],
+                                      profile=args.m),
+                                  DASHBOARDS[name])
+                  for num, name in enumerate(args.d)}
+
+    if args.p is not None:
+        RenderHandler.dashboards = dashboards
+        RenderHandler.interval = args.i
+        server = ThreadingHTTPServer(('localhost', args.p), RenderHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(F'serving on http://localhost:{args.p}/')
+
+    while True:
+        if args.o is not None:
+            [dashboard.write(args.o, name, args.f)
+             for name, dashboard in dashboards.items()]
+            if args.m:
+                [dashboard.dat.stats.to_prometheus(
+                    os.path.join(args.o, F'{name}.prom'))
+                 for name, dashboard in dashboards.items()]
+        time.sleep(args.i)
+        [dashboard.update() for dashboard in dashboards.values()]